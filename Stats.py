@@ -1,39 +1,258 @@
+import os
 import pandas as pd
 import numpy as np
-import scipy.stats as sps
+from heapq import heappush, heappop
+from math import floor
 from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from multiprocessing import shared_memory
 from numpy.linalg import multi_dot as mdot
-from scipy.optimize import minimize
 from datetime import timedelta
+from itertools import product
 
 EX_PATH = "../extracts/"
 VAR_MODES = ["historic", "parametric", "modified", "conditional"]
+STORAGE_MODES = ["dense", "ragged"]
+HZ_MODES = ["cumulative", "annualized"]
+SCENARIO_MODES = ["gbm", "bootstrap"]
 PPY = {"daily": 252, "monthly": 12, "quarterly": 4}
+CACHE_SIZE = 32
+FLAT_TOL = 1e6 * np.finfo(np.float64).eps
+STATS_COLS = ["Days", "Start", "End", "Cumulative Return", "Annualized Return",
+              "Annualized Volatility", "Annualized Sharpe Ratio", "Mean",
+              "Volatility", "Skewness", "Kurtosis", "Max Drawdown",
+              "Max Drawdown Date", "Historic VaR", "Parametric VaR",
+              "Modified VaR", "Conditional VaR"]
 
 
 class Stats(object):
-    def __init__(self, r, f, name, rf=0.04, var_lev=0.05, init=True):
-        self.r0 = r
-        self.r = r
+    def __init__(self, r, f, name, rf=0.04, var_lev=0.05, init=True,
+                 cache_size=CACHE_SIZE, incremental=False, storage="dense",
+                 dtype=np.float64):
         self.rf = rf
         self.f = f
         self.var_lev = var_lev
-        self.min_date = self.r0.index.min()
-        self.max_date = self.r0.index.max()
-        self.hz = (self.r.index.min(), self.r.index.max())
         self.ppy = PPY[self.f]
         self.name = name
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.incremental = incremental
+        if storage not in STORAGE_MODES:
+            raise ValueError("unknown storage mode: " + str(storage) +
+                             ", expected one of " + ", ".join(STORAGE_MODES))
+        self.storage = storage
+        self.dtype = np.dtype(dtype)
+        self.r0 = r
+
+# ******************************* RETURN VIEWS ********************************
+    # dense storage keeps returns in one column-major array wrapped by a
+    # single frame, so horizons and columns are iloc slices of it; pandas'
+    # copy-on-write copies a slice only if a caller writes to it. ragged
+    # storage keeps each column's first..last valid span back to back in
+    # one buffer and pads frames with NaN on request, while stats and
+    # drawdowns walk it column by column. dtype may be float32 to halve
+    # either layout; views hand out float64, so nothing computes in float32
+    @property
+    def r0(self):
+        return self.view(start=0, end=len(self.dates))
+
+    @r0.setter
+    def r0(self, r):
+        r = pd.DataFrame(r)
+        values = np.asfortranarray(r.values, dtype=self.dtype)
+        self.dates = r.index
+        self.names = r.columns
+        if self.storage == "ragged":
+            valid = ~np.isnan(values)
+            has = valid.any(axis=0)
+            first = np.where(has, valid.argmax(axis=0), 0)
+            last = np.where(has, len(values) - valid[::-1].argmax(axis=0), 0)
+            self.first = first
+            self.offsets = np.append(0, np.cumsum(last - first))
+            self.values = np.concatenate(
+                [values[i:j, c] for c, (i, j) in enumerate(zip(first, last))] +
+                [np.empty(0, self.dtype)])
+            self.frame = pd.Series(self.values, copy=False)
+        else:
+            self.values = values
+            self.frame = pd.DataFrame(self.values, index=self.dates,
+                                      columns=self.names, copy=False)
+        self.reset_dates()
+
+    def reset_dates(self):
+        self.min_date = self.dates.min()
+        self.max_date = self.dates.max()
+        self.hz_pos = (0, len(self.dates))
+        self.hz = (self.min_date, self.max_date)
+        self.clear_cache()
+
+    @property
+    def r(self):
+        return self.view()
+
+    def view(self, columns=None, start=None, end=None, dropna=False):
+        # positional start/end default to the current horizon; columns that
+        # are evenly spaced, as after dropping a first or last column, stay
+        # a view, any other selection is gathered into a copy
+        i = self.hz_pos[0] if start is None else start
+        j = self.hz_pos[1] if end is None else end
+        cols = slice(None)
+        if columns is not None:
+            pos = self.names.get_indexer(columns)
+            if (pos < 0).any():
+                raise KeyError(np.asarray(columns)[pos < 0].tolist())
+            step = pos[1] - pos[0] if len(pos) > 1 else 1
+            if len(pos) and step > 0 and (np.diff(pos) == step).all():
+                cols = slice(pos[0], pos[-1] + 1, step)
+            else:
+                cols = pos
+        a = self.block(i, j, cols)
+        if self.storage == "ragged":
+            r = pd.DataFrame(a, index=self.dates[i:j],
+                             columns=self.names[cols], copy=False)
+        else:
+            r = self.frame.iloc[i:j, cols].astype(np.float64)
+        if dropna:
+            i, j, gaps = self.span(~np.isnan(a).all(axis=1))
+            return r.dropna(how="all") if gaps else r.iloc[i:j]
+        return r
+
+    def block(self, i, j, cols=slice(None)):
+        # rows i:j of the selected columns as a float64 (rows, columns)
+        # array, a slice of the buffer when dense and NaN-padded when ragged
+        if self.storage != "ragged":
+            return np.asarray(self.values[i:j, cols], dtype=np.float64)
+        cols = np.arange(len(self.names))[cols]
+        a = np.full((j - i, len(cols)), np.nan, order="F")
+        for x, c in enumerate(cols):
+            lo, hi = self.col_span(c, i, j)
+            pos = self.offsets[c] - self.first[c]
+            a[lo - i:hi - i, x] = self.values[pos + lo:pos + hi]
+        return a
+
+    def col_span(self, c, i, j):
+        # rows of [i, j) that column c's stored span covers
+        length = self.offsets[c + 1] - self.offsets[c]
+        lo = min(max(i, self.first[c]), j)
+        return lo, max(min(j, self.first[c] + length), lo)
+
+    def column(self, entity, start=None, end=None):
+        # the entity over [start, end] with leading and trailing NaNs
+        # trimmed, like r0[entity][start:end].dropna() but zero-copy unless
+        # the column has interior gaps or is stored as float32
+        i, j = self.hz_slice(start, end)
+        r = self.col_series(self.names.get_loc(entity), i, j)
+        k, l, gaps = self.span(r.notna().values)
+        return r.dropna() if gaps else r.iloc[k:l]
+
+    def col_series(self, c, i, j):
+        # column c over rows i:j as float64, cut to its stored span when
+        # ragged
+        if self.storage == "ragged":
+            i, j = self.col_span(c, i, j)
+            pos = self.offsets[c] - self.first[c]
+            r = self.frame.iloc[pos + i:pos + j].set_axis(self.dates[i:j])
+            r.name = self.names[c]
+        else:
+            r = self.frame.iloc[i:j, c]
+        return r.astype(np.float64)
+
+    def by_column(self, fun):
+        # fun over the horizon's returns frame; ragged storage hands it one
+        # column's span at a time and stacks the results, so no NaN-padded
+        # frame of every column is built
+        if self.storage != "ragged":
+            return fun(self.r)
+        i, j = self.hz_pos
+        spans = [self.col_span(c, i, j) for c in range(len(self.names))]
+        parts = [fun(self.col_series(c, i, j).to_frame())
+                 for c, (lo, hi) in enumerate(spans) if hi > lo]
+        parts = [x for x in parts if len(x)]
+        return pd.concat(parts) if parts else fun(self.view([]))
+
+    def span(self, valid):
+        pos = np.flatnonzero(valid)
+        if not len(pos):
+            return 0, 0, False
+        i, j = pos[0], pos[-1] + 1
+        return i, j, j - i != len(pos)
 
 # ************************** CHANGE CLASS PARAMETERS **************************
     def change_hz(self, start="1989", end="2049"):
-        self.r = self.r0[start:end]
-        self.hz = (self.r.index.min(), self.r.index.max())
+        self.hz_pos = self.hz_slice(start, end)
+        dates = self.dates[self.hz_pos[0]:self.hz_pos[1]]
+        self.hz = (dates.min(), dates.max())
+
+    def fill_gaps(self):
+        # interior gaps become zero returns; cells before a column's first or
+        # after its last valid value stay NaN and rows outside every column's
+        # life are dropped. the filled array becomes the buffer r0 and r view
+        if self.storage == "ragged" and self.dates.is_monotonic_increasing:
+            return self.fill_spans()
+        v = self.r.values.copy()
+        valid = ~np.isnan(v)
+        inside = (np.logical_or.accumulate(valid, axis=0) &
+                  np.logical_or.accumulate(valid[::-1], axis=0)[::-1])
+        v[inside & ~valid] = 0
+        keep = inside.any(axis=1)
+        r = pd.DataFrame(v[keep], index=self.r.index[keep],
+                         columns=self.r.columns, copy=False)
+        if not r.index.is_monotonic_increasing:
+            r = r.sort_index(kind="stable")
+        self.r0 = r
+
+    def fill_spans(self):
+        # ragged spans already run from first to last valid value, so gaps
+        # are the NaNs inside the buffer; dropping rows no span covers only
+        # shifts each span's first row
+        n = len(self.dates)
+        last = self.first + np.diff(self.offsets)
+        cover = np.zeros(n + 1, dtype=np.int64)
+        np.add.at(cover, self.first, 1)
+        np.add.at(cover, last, -1)
+        keep = np.cumsum(cover)[:n] > 0
+        self.values = np.where(np.isnan(self.values), 0, self.values)
+        self.values = self.values.astype(self.dtype, copy=False)
+        self.frame = pd.Series(self.values, copy=False)
+        self.first = (np.cumsum(keep) - keep)[self.first]
+        self.dates = self.dates[keep]
+        self.reset_dates()
 
     def change_var_lev(self, var_lev):
         self.var_lev = var_lev
+        self.clear_cache("stats")
 
     def change_rf(self, rf):
         self.rf = rf
+        self.clear_cache("stats")
+
+# ********************************** CACHE ************************************
+    def cached(self, key, fun):
+        # entries are keyed on the horizon, so moving the horizon never hits
+        # a stale entry and moving it back reuses the old one
+        key = (self.hz,) + key
+        if key in self.cache:
+            self.cache.move_to_end(key)
+        else:
+            self.cache[key] = fun()
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return self.cache[key].copy()
+
+    def clear_cache(self, kind=None):
+        for key in [x for x in self.cache if kind in (None, x[1])]:
+            del self.cache[key]
+        if kind is None:
+            self.prefix = None
+
+    def mv_inputs(self, group):
+        er = self.cached(("er", tuple(group)), lambda:
+                         self.stats_engine(self.view(group))
+                         ["Annualized Return"])
+        cov = self.cached(("cov", tuple(er.index)), lambda:
+                          self.view(er.index).cov())
+        return er, cov
 
 # ************************** STATISTICAL COMPUTATIONS *************************
     def hz_r(self, r, mode="cumulative"):
@@ -60,13 +279,68 @@ class Stats(object):
     def skewness(self, r):
         dmr = r - r.mean()
         s = r.std(ddof=0)
+        s = s * np.where(self.is_flat((dmr**2).sum(), (r**2).sum()), np.nan, 1)
         return (dmr**3).mean() / s**3
 
     def kurtosis(self, r):
         dmr = r - r.mean()
         s = r.std(ddof=0)
+        s = s * np.where(self.is_flat((dmr**2).sum(), (r**2).sum()), np.nan, 1)
         return (dmr**4).mean() / s**4
 
+    def is_flat(self, m2, scale):
+        # a sum of squared deviations within rounding of the sums it came
+        # from is no variance at all, where skewness and kurtosis are 0/0
+        return m2 <= FLAT_TOL * scale
+
+    def rolling_moments(self, r: pd.Series, window=252, mode="rolling",
+                        vol_mode="periodic"):
+        self.check_instance(r, "pd.Series", "rolling_moments")
+        x = np.asarray(r.values, dtype=np.float64)
+        valid = ~np.isnan(x)
+        # shifting by the sample mean keeps the power sums small, so the
+        # window differences below do not cancel catastrophically
+        shift = x[valid].mean() if valid.any() else 0
+        y = np.where(valid, x - shift, 0)
+        sums = np.zeros((5, len(x) + 1))
+        sums[:, 1:] = np.cumsum([valid, y, y**2, y**3, y**4], axis=1)
+        scale = sums[2, 1:]
+        if mode == "rolling":
+            lag = np.maximum(np.arange(1, len(x) + 1) - window, 0)
+            sums = sums[:, 1:] - sums[:, lag]
+        elif mode == "expanding":
+            sums = sums[:, 1:]
+        n = sums[0]
+        mu, vol, skew, kurt = self.power_moments(*sums, scale=scale)
+        if vol_mode == "annualized":
+            vol = vol * np.sqrt(self.ppy)
+
+        moments = pd.DataFrame(OrderedDict({
+                "Count": n,
+                "Mean": mu + shift,
+                "Volatility": vol,
+                "Skewness": skew,
+                "Kurtosis": kurt}), index=r.index)
+        moments[n < window] = np.nan
+        return moments
+
+    def power_moments(self, n, s1, s2, s3, s4, scale=None):
+        # mean, volatility, skewness and kurtosis from count and power sums;
+        # sums differenced out of running totals carry those totals'
+        # rounding, so scale is the running s2 they came from
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mu = s1 / n
+            m2 = s2 - n*mu**2
+            m3 = s3 - 3*mu*s2 + 2*n*mu**3
+            m4 = s4 - 4*mu*s3 + 6*mu**2*s2 - 3*n*mu**4
+            flat = self.is_flat(m2, s2 if scale is None else scale)
+            m2 = np.where(flat, 0, m2)
+            vol = np.sqrt(np.maximum(m2, 0) / (n - 1))
+            sd0 = np.sqrt(np.where(flat, np.nan, m2) / n)
+            skew = m3 / n / sd0**3
+            kurt = m4 / n / sd0**4
+        return mu, vol, skew, kurt
+
     def drawdowns(self, r: pd.Series, mode="max"):
         self.check_instance(r, "pd.Series", "drawdowns")
         wealth = 100 * (1 + r).cumprod()
@@ -86,6 +360,7 @@ class Stats(object):
             return drawdown.idxmin()
 
     def var(self, r: pd.Series, lev=5, mode="historic"):
+        import scipy.stats as sps
         self.check_instance(r, "pd.Series", "var")
         z = sps.norm.ppf(lev/100)
         rm = self.hz_r(r, "mean")
@@ -106,7 +381,176 @@ class Stats(object):
             is_beyond = r <= -self.var(r, lev=lev, mode="historic")
             return -self.hz_r(r[is_beyond], "mean")
 
+    def rolling_var(self, r: pd.Series, lev=5, window=252, mode="rolling"):
+        import scipy.stats as sps
+        self.check_instance(r, "pd.Series", "rolling_var")
+        x = np.asarray(r.values, dtype=np.float64)
+        q = lev / 100
+        h_var = np.full(len(x), np.nan)
+        c_var = np.full(len(x), np.nan)
+
+        # two heaps split the window into its lo + 1 lowest values and the
+        # rest, with evicted values dropped lazily once they reach a top; the
+        # low side's sum is carried with Neumaier compensation, so each step
+        # is O(log n) and the tail below the historic quantile is the low
+        # side plus any ties with it on the high side
+        low, high = [], []
+        n_low = n_high = 0
+        in_low, count, dead_low, dead_high = {}, {}, {}, {}
+        tail, comp = 0.0, 0.0
+        for t, v in enumerate(x):
+            if v == v:
+                while low and dead_low.get(-low[0]):
+                    dead_low[-low[0]] -= 1
+                    heappop(low)
+                if n_low and v <= -low[0]:
+                    heappush(low, -v)
+                    in_low[v] = in_low.get(v, 0) + 1
+                    n_low += 1
+                    tail, comp = self.neumaier(tail, comp, v)
+                else:
+                    heappush(high, v)
+                    n_high += 1
+                count[v] = count.get(v, 0) + 1
+            if mode == "rolling" and t >= window:
+                old = x[t - window]
+                if old == old:
+                    if in_low.get(old):
+                        in_low[old] -= 1
+                        dead_low[old] = dead_low.get(old, 0) + 1
+                        n_low -= 1
+                        tail, comp = self.neumaier(tail, comp, -old)
+                    else:
+                        dead_high[old] = dead_high.get(old, 0) + 1
+                        n_high -= 1
+                    count[old] -= 1
+            n = n_low + n_high
+            if n < window:
+                continue
+            # linear interpolation, as np.nanpercentile does it
+            vi = (n - 1) * q
+            lo = floor(vi)
+            while n_low != lo + 1:
+                src, dead = (low, dead_low) if n_low > lo + 1 else \
+                    (high, dead_high)
+                sign = -1 if src is low else 1
+                while dead.get(sign * src[0]):
+                    dead[sign * src[0]] -= 1
+                    heappop(src)
+                u = sign * heappop(src)
+                if src is low:
+                    heappush(high, u)
+                    in_low[u] -= 1
+                    n_low, n_high = n_low - 1, n_high + 1
+                    tail, comp = self.neumaier(tail, comp, -u)
+                else:
+                    heappush(low, -u)
+                    in_low[u] = in_low.get(u, 0) + 1
+                    n_low, n_high = n_low + 1, n_high - 1
+                    tail, comp = self.neumaier(tail, comp, u)
+            while dead_low.get(-low[0]):
+                dead_low[-low[0]] -= 1
+                heappop(low)
+            while high and dead_high.get(high[0]):
+                dead_high[high[0]] -= 1
+                heappop(high)
+            v_lo = -low[0]
+            v_hi = high[0] if n_high else v_lo
+            g = vi - lo
+            d = v_hi - v_lo
+            pct = v_hi - d*(1 - g) if g >= 0.5 else v_lo + d*g
+            ties = count[v_hi] - in_low.get(v_hi, 0) if pct == v_hi else 0
+            h_var[t] = -pct
+            c_var[t] = -(tail + comp + ties * pct) / (n_low + ties)
+
+        z = sps.norm.ppf(q)
+        m = self.rolling_moments(r, window, mode)
+        sk, kt = m["Skewness"], m["Kurtosis"]
+        z_mod = (z +
+                 (z**2 - 1) * sk/6 +
+                 (z**3 - 3*z) * (kt - 3)/24 -
+                 (2*z**3 - 5*z) * (sk**2)/36)
+
+        return pd.DataFrame(OrderedDict({
+                "historic": h_var,
+                "parametric": -(m["Mean"] + z*m["Volatility"]),
+                "modified": -(m["Mean"] + z_mod*m["Volatility"]),
+                "conditional": c_var}), index=r.index)[VAR_MODES]
+
+    def neumaier(self, total, comp, v):
+        # compensated running sum: the rounding lost by total + v is kept in
+        # comp, so adding and later removing values leaves no drift
+        t = total + v
+        if abs(total) >= abs(v):
+            comp += (total - t) + v
+        else:
+            comp += (v - t) + total
+        return t, comp
+
+    def rolling_returns(self, r: pd.Series, window=252, mode="annualized"):
+        # hz_r over every full window, from prefix sums of log-returns; a
+        # window with a NaN has no value, as with rolling(window).agg
+        self.check_instance(r, "pd.Series", "rolling_returns")
+        x = np.asarray(r.values, dtype=np.float64)
+        valid = ~np.isnan(x)
+        sums = np.zeros((2, len(x) + 1))
+        sums[:, 1:] = np.cumsum([valid, np.where(valid, np.log1p(x), 0)],
+                                axis=1)
+        lag = np.maximum(np.arange(1, len(x) + 1) - window, 0)
+        n, log_r = sums[:, 1:] - sums[:, lag]
+        cum = np.where(n == window, np.expm1(log_r), np.nan)
+        if mode == "annualized" and window >= self.ppy:
+            cum = (1 + cum) ** (self.ppy / window) - 1
+        return pd.Series(cum, index=r.index, name=r.name)
+
+    def rolling_average_cor(self, r: pd.DataFrame, window=252,
+                            max_block=2**20):
+        # np.nanmean of each date's r.rolling(window).corr() matrix, diagonal
+        # included, without the (dates x k x k) cube: windowed sums of
+        # counts, returns, squares and cross-products are rebuilt exactly at
+        # each block's start and carried through the block by cumulative
+        # rank-one updates, with blocks of at most max_block matrix entries
+        x = np.asarray(r.values, dtype=np.float64)
+        n, k = x.shape
+        valid = ~np.isnan(x)
+        # shifting by the column means keeps the cross-products small, and a
+        # leading zero row is what leaves the first full window
+        shift = np.where(valid, x, 0).sum(axis=0) / \
+            np.maximum(valid.sum(axis=0), 1)
+        v = np.vstack([np.zeros(k), valid])
+        x = np.vstack([np.zeros(k), np.where(valid, x - shift, 0)])
+        step = max(1, min(window, max_block // max(k * k, 1)))
+        avg = np.full(n, np.nan)
+        for b in range(window, n + 1, step):
+            e = min(b + step, n + 1)
+            w0 = slice(b - window, b)
+            sums = np.stack([v[w0].T.dot(v[w0]), x[w0].T.dot(v[w0]),
+                             (x[w0]**2).T.dot(v[w0]), x[w0].T.dot(x[w0])])
+            sums = sums[:, None] + np.cumsum(
+                self.cross_products(x[b:e], v[b:e]) -
+                self.cross_products(x[b - window:e - window],
+                                    v[b - window:e - window]), axis=1)
+            cnt, sx, sxx, sxy = sums
+            sy, syy = sx.transpose(0, 2, 1), sxx.transpose(0, 2, 1)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                var = (cnt * sxx - sx**2) * (cnt * syy - sy**2)
+                cor = (cnt * sxy - sx * sy) / np.sqrt(var)
+            ok = (np.round(cnt) == window) & (var > 0)
+            hits = ok.sum(axis=(1, 2))
+            with np.errstate(invalid="ignore"):
+                avg[b - 1:e - 1] = np.where(ok, cor, 0).sum(axis=(1, 2)) / \
+                    np.where(hits > 0, hits, np.nan)
+        return pd.Series(avg, index=r.index)
+
+    def cross_products(self, x, v):
+        # per-row outer products behind rolling_average_cor's window sums
+        return np.stack([v[:, :, None] * v[:, None, :],
+                         x[:, :, None] * v[:, None, :],
+                         x[:, :, None]**2 * v[:, None, :],
+                         x[:, :, None] * x[:, None, :]])
+
     def jb_test(self, r: pd.Series, mode="stat"):
+        import scipy.stats as sps
         self.check_instance(r, "pd.Series", "jb_test")
         r = r[~pd.isnull(r)]
         try:
@@ -115,14 +559,23 @@ class Stats(object):
             stat, p = (np.nan, np.nan)
         return stat if mode == "stat" else p
 
-    def stats(self, df=None):
+    def stats(self, df=None, mode="vectorized"):
         if df is None:
-            r = self.r
-        else:
-            r = df
+            if mode == "vectorized":
+                return self.cached(("stats", self.rf, self.var_lev),
+                                   lambda: self.hz_stats()
+                                   if self.incremental
+                                   else self.by_column(self.stats_engine))
+            return self.by_column(lambda x: self.stats(x, mode))
+        r = df
+
+        if mode == "vectorized":
+            return self.stats_engine(r)
 
         var_dc = {x: r.agg(self.var, lev=self.var_lev*100, mode=x)
                   for x in VAR_MODES}
+        dd = pd.DataFrame(self.drawdown_engine(r.values)[2], index=r.index,
+                          columns=r.columns)
         stats_table = pd.DataFrame(OrderedDict({
             "Days": r.count(),
             "Start": r.agg(self.get_hz, mode="min"),
@@ -137,8 +590,8 @@ class Stats(object):
             "Volatility": self.hz_vol(r),
             "Skewness": self.skewness(r),
             "Kurtosis": self.kurtosis(r),
-            "Max Drawdown": r.agg(self.drawdowns),
-            "Max Drawdown Date": r.agg(self.drawdowns, mode="date"),
+            "Max Drawdown": dd.min(),
+            "Max Drawdown Date": dd.idxmin(),
             "Historic VaR": var_dc["historic"],
             "Parametric VaR": var_dc["parametric"],
             "Modified VaR": var_dc["modified"],
@@ -146,6 +599,335 @@ class Stats(object):
                 }))
         return stats_table[stats_table["Days"] != 0]
 
+    def stats_engine(self, r):
+        import scipy.stats as sps
+        if isinstance(r, pd.Series):
+            r = r.to_frame()
+        a = np.asarray(r.values, dtype=np.float64)
+        valid = ~np.isnan(a)
+        days = valid.sum(axis=0)
+        has = days > 0
+        if not has.any():
+            return pd.DataFrame(columns=STATS_COLS)
+        a, valid, days = a[:, has], valid[:, has], days[has]
+        first = valid.argmax(axis=0)
+        last = a.shape[0] - 1 - valid[::-1].argmax(axis=0)
+        a0 = np.where(valid, a, 0)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # central moments, two-pass like pandas' nanops
+            mean = a0.sum(axis=0) / days
+            dmr = np.where(valid, a - mean, 0)
+            m2 = (dmr**2).sum(axis=0)
+            vol = np.sqrt(m2 / (days - 1))
+            flat = self.is_flat(m2, (a0**2).sum(axis=0))
+            sd0 = np.sqrt(np.where(flat, np.nan, m2) / days)
+            skew = (dmr**3).sum(axis=0) / days / sd0**3
+            kurt = (dmr**4).sum(axis=0) / days / sd0**4
+
+            # cumulative log-returns and annualization
+            cum = np.expm1(np.where(valid, np.log1p(a), 0).sum(axis=0))
+            ann_factor = np.where(days >= self.ppy, self.ppy / days, 1)
+            ann_r = (1 + cum) ** ann_factor - 1
+            ann_vol = vol * np.sqrt(self.ppy)
+
+            _, _, drawdown = self.drawdown_engine(a)
+            max_dd = np.nanmin(drawdown, axis=0)
+            max_dd_pos = np.nanargmin(drawdown, axis=0)
+
+            # value at risk
+            lev = self.var_lev * 100
+            z = sps.norm.ppf(lev / 100)
+            h_var = -np.nanpercentile(a, lev, axis=0)
+            p_var = -(mean + z*vol)
+            z_mod = (z +
+                     (z**2 - 1) * skew/6 +
+                     (z**3 - 3*z) * (kurt - 3)/24 -
+                     (2*z**3 - 5*z) * (skew**2)/36)
+            m_var = -(mean + z_mod*vol)
+            is_beyond = valid & (a <= -h_var)
+            c_var = -(np.where(is_beyond, a, 0).sum(axis=0) /
+                      is_beyond.sum(axis=0))
+
+        dates = r.index
+        stats_table = pd.DataFrame(OrderedDict({
+            "Days": days,
+            "Start": dates[first],
+            "End": dates[last],
+            "Cumulative Return": cum,
+            "Annualized Return": ann_r,
+            "Annualized Volatility": ann_vol,
+            "Annualized Sharpe Ratio": (1 / ann_vol) * (ann_r - self.rf),
+            "Mean": mean,
+            "Volatility": vol,
+            "Skewness": skew,
+            "Kurtosis": kurt,
+            "Max Drawdown": max_dd,
+            "Max Drawdown Date": dates[max_dd_pos],
+            "Historic VaR": h_var,
+            "Parametric VaR": p_var,
+            "Modified VaR": m_var,
+            "Conditional VaR": c_var
+                }), index=r.columns[has])
+        return stats_table
+
+# ******************************** DRAWDOWNS **********************************
+    def drawdown_engine(self, a):
+        # wealth, running peaks and drawdowns of every column of an (n, k)
+        # array in one pass; NaNs never set a peak
+        a = np.asarray(a, dtype=np.float64)
+        valid = ~np.isnan(a)
+        wealth = 100 * np.cumprod(np.where(valid, 1 + a, 1), axis=0)
+        wealth[~valid] = np.nan
+        peaks = np.fmax.accumulate(wealth, axis=0)
+        with np.errstate(invalid="ignore"):
+            drawdown = (wealth - peaks) / peaks
+        return wealth, peaks, drawdown
+
+    def drawdown_episodes(self, r=None):
+        # one row per drawdown: the peak it falls from, its trough, the day
+        # it is back at the peak (NaT while under water), depth and duration
+        # in periods from the peak to recovery or the last observation
+        if r is None:
+            return self.cached(("episodes",),
+                               lambda: self.by_column(self.drawdown_episodes))
+        a = np.asarray(r.values, dtype=np.float64)
+        n, k = a.shape
+        _, _, dd = self.drawdown_engine(a)
+
+        # gaps carry the last drawdown forward so an episode spans them
+        last = np.where(~np.isnan(a), np.arange(n)[:, None], -1)
+        last = np.maximum.accumulate(last, axis=0)
+        dd = np.where(last >= 0, dd[np.maximum(last, 0), np.arange(k)], 0)
+
+        # episodes are runs of dd < 0 in the column-major flattening, with
+        # runs cut at column boundaries
+        under = (dd < 0).ravel(order="F")
+        prev = np.append(False, under[:-1])
+        prev[::max(n, 1)] = False
+        is_start = under & ~prev
+        start = np.flatnonzero(is_start)
+        if not len(start):
+            return pd.DataFrame(columns=["Peak Date", "Trough Date",
+                                         "Recovery Date", "Depth",
+                                         "Duration"])
+        stop = np.flatnonzero(under & ~np.append(under[1:], False))
+        col, flat_dd = start // n, dd.ravel(order="F")
+        stop = np.minimum(stop - col * n + 1, n)
+        depth = np.minimum.reduceat(flat_dd, start)
+        ep = np.cumsum(is_start)
+        hit = np.flatnonzero(under & (flat_dd == depth[ep - 1]))
+        trough = hit[np.unique(ep[hit], return_index=True)[1]] - col * n
+        peak = last.ravel(order="F")[start - 1]
+        recovered = stop < n
+        duration = np.where(recovered, stop, last[-1, col]) - peak
+
+        dates = r.index
+        return pd.DataFrame(OrderedDict({
+            "Peak Date": dates[peak],
+            "Trough Date": dates[trough],
+            "Recovery Date": dates[np.minimum(stop, n - 1)].where(recovered),
+            "Depth": depth,
+            "Duration": duration
+                }), index=r.columns[col])
+
+# ***************************** INCREMENTAL MODE ******************************
+    def hz_slice(self, start="1989", end="2049"):
+        sl = self.dates.slice_indexer(start, end)
+        return sl.start or 0, len(self.dates) if sl.stop is None else sl.stop
+
+    def build_prefix(self):
+        # prefix sums over r0 for counts, log-returns and shifted power sums,
+        # plus a segment tree of log-wealth for range drawdowns
+        a = np.asarray(self.block(0, len(self.dates)), dtype=np.float64)
+        valid = ~np.isnan(a)
+        n, k = a.shape
+        a0 = np.where(valid, a, 0)
+        shift = a0.sum(axis=0) / np.maximum(valid.sum(axis=0), 1)
+        y = np.where(valid, a - shift, 0)
+        sums = np.zeros((6, n + 1, k))
+        sums[:, 1:] = np.cumsum([valid, np.log1p(a0), y, y**2, y**3, y**4],
+                                axis=1)
+
+        size = 1 << max(n - 1, 0).bit_length()
+        pos = np.broadcast_to(np.arange(n)[:, None], (n, k))
+        tree = [np.full((2 * size, k), np.inf), np.full((2 * size, k), -1),
+                np.zeros((2 * size, k)), np.full((2 * size, k), -1),
+                np.full((2 * size, k), -np.inf)]
+        tree[0][size:size + n] = np.where(valid, sums[1, 1:], np.inf)
+        tree[1][size:size + n] = np.where(valid, pos, -1)
+        tree[4][size:size + n] = np.where(valid, sums[1, 1:], -np.inf)
+        level = size // 2
+        while level:
+            nodes = np.arange(level, 2 * level)
+            merged = self.dd_merge([x[2 * nodes] for x in tree],
+                                   [x[2 * nodes + 1] for x in tree])
+            for x, m in zip(tree, merged):
+                x[nodes] = m
+            level //= 2
+
+        self.prefix = {"sums": sums, "shift": shift, "size": size,
+                       "tree": tree}
+        return self.prefix
+
+    def dd_merge(self, a, b):
+        # nodes are (min, argmin, max drawdown, trough, max) of log-wealth;
+        # the drawdown across the seam is b's low against a's high
+        a_min, a_arg, a_dd, a_tr, a_max = a
+        b_min, b_arg, b_dd, b_tr, b_max = b
+        seam = b_min - a_max
+        b_best = np.minimum(seam, b_dd)
+        a_wins = a_dd <= b_best
+        return [np.minimum(a_min, b_min),
+                np.where(a_min <= b_min, a_arg, b_arg),
+                np.where(a_wins, a_dd, b_best),
+                np.where(a_wins, a_tr, np.where(seam <= b_dd, b_arg, b_tr)),
+                np.maximum(a_max, b_max)]
+
+    def dd_query(self, i, j):
+        px = self.prefix or self.build_prefix()
+        tree, k = px["tree"], px["sums"].shape[2]
+        left = [np.full(k, np.inf), np.full(k, -1), np.zeros(k),
+                np.full(k, -1), np.full(k, -np.inf)]
+        right = [x.copy() for x in left]
+        lo, hi = i + px["size"], j + px["size"]
+        while lo < hi:
+            if lo & 1:
+                left = self.dd_merge(left, [x[lo] for x in tree])
+                lo += 1
+            if hi & 1:
+                hi -= 1
+                right = self.dd_merge([x[hi] for x in tree], right)
+            lo //= 2
+            hi //= 2
+        return self.dd_merge(left, right)
+
+    def hz_bound(self, label, side="start"):
+        # partial date strings cover their whole period, as in r0[start:end]
+        if isinstance(label, str):
+            period = pd.Period(label)
+            return period.start_time if side == "start" else period.end_time
+        return pd.Timestamp(label)
+
+    def hz_returns(self, ranges, mode="annualized"):
+        if mode not in HZ_MODES:
+            raise ValueError("unknown hz_returns mode: " + str(mode) +
+                             ", expected one of " + ", ".join(HZ_MODES))
+        starts, ends = zip(*ranges)
+        dates = self.dates
+        i = dates.searchsorted([self.hz_bound(x, "start") for x in starts],
+                               "left")
+        j = dates.searchsorted([self.hz_bound(x, "end") for x in ends],
+                               "right")
+        j = np.maximum(i, j)
+        px = self.prefix or self.build_prefix()
+        days = px["sums"][0, j] - px["sums"][0, i]
+        cum = np.expm1(px["sums"][1, j] - px["sums"][1, i])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            if mode == "cumulative":
+                hz_r = cum
+            elif mode == "annualized":
+                ann_factor = np.where(days >= self.ppy, self.ppy / days, 1)
+                hz_r = (1 + cum) ** ann_factor - 1
+        hz_r[days == 0] = np.nan
+        return pd.DataFrame(hz_r, columns=self.names,
+                            index=pd.MultiIndex.from_arrays(
+                                [list(starts), list(ends)],
+                                names=["Start", "End"]))
+
+    def calendar_ranges(self, freq="Y"):
+        periods = pd.period_range(self.min_date, self.max_date, freq=freq)
+        return list(zip(periods.start_time, periods.end_time))
+
+    def hz_moments(self, start="1989", end="2049"):
+        return self.range_moments(*self.hz_slice(start, end))
+
+    def range_moments(self, i, j):
+        px = self.prefix or self.build_prefix()
+        n, log_r, s1, s2, s3, s4 = px["sums"][:, j] - px["sums"][:, i]
+        mu, vol, skew, kurt = self.power_moments(n, s1, s2, s3, s4,
+                                                 px["sums"][3, j])
+        return pd.DataFrame(OrderedDict({
+                "Days": n.astype(int),
+                "Cumulative Return": np.expm1(log_r),
+                "Mean": mu + px["shift"],
+                "Volatility": vol,
+                "Skewness": skew,
+                "Kurtosis": kurt}), index=self.names)
+
+    def hz_stats(self, start=None, end=None):
+        import scipy.stats as sps
+        if start is None and end is None:
+            i, j = self.hz_pos
+        else:
+            i, j = self.hz_slice(start or "1989", end or "2049")
+        px = self.prefix or self.build_prefix()
+        count = px["sums"][0]
+        days = count[j] - count[i]
+        has = days > 0
+        if not has.any():
+            return pd.DataFrame(columns=STATS_COLS)
+        days = days[has].astype(int)
+        m = self.range_moments(i, j)[has]
+        cols = np.flatnonzero(has)
+        first = np.array([np.searchsorted(count[:, c], count[i, c], "right")
+                          for c in cols]) - 1
+        last = np.array([np.searchsorted(count[:, c], count[j, c], "left")
+                         for c in cols]) - 1
+
+        _, _, dd, trough, _ = self.dd_query(i, j)
+        trough = np.where(dd[has] < 0, trough[has], first)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ann_factor = np.where(days >= self.ppy, self.ppy / days, 1)
+            ann_r = (1 + m["Cumulative Return"].values) ** ann_factor - 1
+            vol, mean = m["Volatility"].values, m["Mean"].values
+            skew, kurt = m["Skewness"].values, m["Kurtosis"].values
+            ann_vol = vol * np.sqrt(self.ppy)
+
+            # the historic quantile needs the horizon's values, O(n) here,
+            # a column at a time when ragged
+            lev = self.var_lev * 100
+            if self.storage == "ragged":
+                h_var, c_var = np.transpose([
+                    self.hist_var(self.col_series(c, i, j).values, lev)
+                    for c in cols])
+            else:
+                h_var, c_var = self.hist_var(self.block(i, j, cols), lev)
+            z = sps.norm.ppf(lev / 100)
+            z_mod = (z +
+                     (z**2 - 1) * skew/6 +
+                     (z**3 - 3*z) * (kurt - 3)/24 -
+                     (2*z**3 - 5*z) * (skew**2)/36)
+
+        dates = self.dates
+        return pd.DataFrame(OrderedDict({
+            "Days": days,
+            "Start": dates[first],
+            "End": dates[last],
+            "Cumulative Return": m["Cumulative Return"].values,
+            "Annualized Return": ann_r,
+            "Annualized Volatility": ann_vol,
+            "Annualized Sharpe Ratio": (1 / ann_vol) * (ann_r - self.rf),
+            "Mean": mean,
+            "Volatility": vol,
+            "Skewness": skew,
+            "Kurtosis": kurt,
+            "Max Drawdown": np.expm1(dd[has]),
+            "Max Drawdown Date": dates[trough],
+            "Historic VaR": h_var,
+            "Parametric VaR": -(mean + z*vol),
+            "Modified VaR": -(mean + z_mod*vol),
+            "Conditional VaR": c_var
+                }), index=self.names[has])
+
+    def hist_var(self, a, lev):
+        # historic VaR and CVaR of each column of a, NaNs ignored
+        h_var = -np.nanpercentile(a, lev, axis=0)
+        is_beyond = a <= -h_var
+        return h_var, -(np.where(is_beyond, a, 0).sum(axis=0) /
+                        is_beyond.sum(axis=0))
+
 # ********************** MARKOWITZS MEAN-VARIANCE SPACE ***********************
     def port_r(self, w, er):
         return np.dot(w.T, er)
@@ -153,46 +935,179 @@ class Stats(object):
     def port_vol(self, w, cov):
         return np.sqrt(mdot([w.T, cov, w]))
 
-    def minimize_vol(self, target_er, er, cov):
+    def port_vol_grad(self, w, cov=None, chol=None):
+        # returns (vol, d vol / dw); with cov = LL' one product L'w serves both
+        if chol is not None:
+            u = chol.T.dot(w)
+            vol = np.sqrt(u.dot(u))
+            return vol, chol.dot(u) / vol
+        cw = cov.dot(w)
+        vol = np.sqrt(w.dot(cw))
+        return vol, cw / vol
+
+    def minimize_vol(self, target_er, er, cov, initial_w=None, jac=True,
+                     chol=None):
+        from scipy.optimize import minimize
         n = er.count()
-        initial_w = np.repeat(1/n, n)
+        if initial_w is None:
+            initial_w = np.repeat(1/n, n)
         bounds = ((0.0, 1.0),) * n
-        ret_is_target = {"type": "eq", "args": (er,),
-                         "fun": lambda w, er: target_er - self.port_r(w, er)}
-        w_sum_to_1 = {"type": "eq", "fun": lambda w: np.sum(w) - 1}
-        results = minimize(self.port_vol, initial_w, args=(cov,),
-                           method="SLSQP", options={"disp": False},
+        if not jac:
+            ret_is_target = {"type": "eq", "args": (er,),
+                             "fun": lambda w, er:
+                                 target_er - self.port_r(w, er)}
+            w_sum_to_1 = {"type": "eq", "fun": lambda w: np.sum(w) - 1}
+            results = minimize(self.port_vol, initial_w, args=(cov,),
+                               method="SLSQP", options={"disp": False},
+                               constraints=(ret_is_target, w_sum_to_1),
+                               bounds=bounds)
+            return results.x
+
+        er_v = np.asarray(er, dtype=np.float64)
+        cov_v = np.asarray(cov, dtype=np.float64)
+        ret_is_target = {"type": "eq",
+                         "fun": lambda w: target_er - er_v.dot(w),
+                         "jac": lambda w: -er_v}
+        w_sum_to_1 = {"type": "eq", "fun": lambda w: np.sum(w) - 1,
+                      "jac": lambda w: np.ones(n)}
+        results = minimize(self.port_vol_grad, initial_w, args=(cov_v, chol),
+                           jac=True, method="SLSQP", options={"disp": False},
                            constraints=(ret_is_target, w_sum_to_1),
                            bounds=bounds)
         return results.x
 
-    def msr(self, er, cov):
+    def msr(self, er, cov, mode="qp", jac=True, chol=None):
+        from scipy.optimize import minimize
+        if mode == "qp":
+            # max Sharpe is min y'Cy s.t. (er - rf)'y = 1, y >= 0, w = y/sum(y)
+            xr = np.asarray(er, dtype=np.float64) - self.rf
+            k = np.argmax(xr)
+            if xr[k] > 0:
+                y0 = np.zeros(len(xr))
+                y0[k] = 1 / xr[k]
+                y = self.qp_active_set(np.asarray(cov), xr, 1, y0)
+                if y is not None:
+                    return y / y.sum()
+
         n = er.count()
         initial_w = np.repeat(1/n, n)
         bounds = ((0.0, 1.0),) * n
-        w_sum_to_1 = {"type": "eq", "fun": lambda w: np.sum(w) - 1}
+        if not jac:
+            w_sum_to_1 = {"type": "eq", "fun": lambda w: np.sum(w) - 1}
+
+            def nsr(w, rfr, er, cov):
+                r = self.port_r(w, er)
+                vol = self.port_vol(w, cov)
+                return -((r - self.rf)/vol)
 
-        def nsr(w, rfr, er, cov):
-            r = self.port_r(w, er)
-            vol = self.port_vol(w, cov)
-            return -((r - self.rf)/vol)
+            results = minimize(nsr, initial_w, args=(self.rf, er, cov),
+                               method="SLSQP", options={"disp": False},
+                               constraints=(w_sum_to_1), bounds=bounds)
+            return results.x
 
-        results = minimize(nsr, initial_w, args=(self.rf, er, cov),
-                           method="SLSQP", options={"disp": False},
-                           constraints=(w_sum_to_1), bounds=bounds)
+        er_v = np.asarray(er, dtype=np.float64)
+        cov_v = np.asarray(cov, dtype=np.float64)
+        w_sum_to_1 = {"type": "eq", "fun": lambda w: np.sum(w) - 1,
+                      "jac": lambda w: np.ones(n)}
+
+        def nsr(w):
+            xr = er_v.dot(w) - self.rf
+            vol, d_vol = self.port_vol_grad(w, cov_v, chol)
+            return -xr/vol, -(er_v*vol - xr*d_vol) / vol**2
+
+        results = minimize(nsr, initial_w, jac=True, method="SLSQP",
+                           options={"disp": False}, constraints=(w_sum_to_1),
+                           bounds=bounds)
         return results.x
 
-    def gmv(self, cov):
+    def gmv(self, cov, mode="qp", jac=True, chol=None):
         n = cov.shape[0]
-        return self.msr(pd.Series(np.repeat(1, n)), cov)
+        if mode == "qp":
+            w = self.qp_active_set(np.asarray(cov), np.ones(n), 1,
+                                   np.repeat(1/n, n))
+            if w is not None:
+                return w
+        return self.msr(pd.Series(np.repeat(1, n)), cov, "slsqp", jac, chol)
+
+    def optimal_w(self, n, er, cov, mode="qp"):
+        return self.frontier(n, er, cov, mode)
 
-    def optimal_w(self, n, er, cov):
-        target_er = np.linspace(er.min(), er.max(), n)
-        w = [self.minimize_vol(target_er, er, cov) for target_er in target_er]
+    def frontier(self, n, er, cov, mode="qp"):
+        # walks the target returns upwards, starting every point from the
+        # previous optimum instead of from equal weights
+        from scipy.optimize import minimize
+        er_v = np.asarray(er, dtype=np.float64)
+        cov_v = np.asarray(cov, dtype=np.float64)
+        target_er = np.linspace(er_v.min(), er_v.max(), n)
+        i_max = np.argmax(er_v)
+        w_prev = np.zeros(len(er_v))
+        w_prev[np.argmin(er_v)] = 1
+        a = np.vstack([er_v, np.ones(len(er_v))])
+        w = []
+        for t in target_er:
+            # mixing in the top-return asset hits the new target exactly,
+            # which keeps the warm start feasible
+            t_prev = er_v.dot(w_prev)
+            theta = (t - t_prev) / (er_v[i_max] - t_prev) \
+                if er_v[i_max] > t_prev else 0
+            w0 = (1 - theta) * w_prev
+            w0[i_max] += theta
+            if mode == "qp":
+                w_t = self.qp_active_set(cov_v, a, np.array([t, 1]), w0)
+            else:
+                w_t = None
+            if w_t is None:
+                # unit-scaled variance keeps SLSQP's ftol meaningful
+                c = cov_v / np.abs(np.diag(cov_v)).max()
+                w_t = minimize(lambda w: mdot([w, c, w]), w0,
+                               jac=lambda w: 2 * c.dot(w),
+                               method="SLSQP", options={"disp": False},
+                               constraints=({"type": "eq", "fun":
+                                             lambda w: a.dot(w) - [t, 1],
+                                             "jac": lambda w: a},),
+                               bounds=((0.0, 1.0),) * len(er_v)).x
+            w.append(w_t)
+            w_prev = w_t
         return w
 
-    def mef(self, n, er, cov):
-        w = self.optimal_w(n, er, cov)
+    def qp_active_set(self, cov, a, b, w0, max_iter=None):
+        # primal active-set method for min w'Cw s.t. aw = b, w >= 0 from a
+        # feasible w0 (Nocedal & Wright, Alg. 16.3); None if it stalls
+        a = np.atleast_2d(a).astype(np.float64)
+        n, n_eq = len(w0), a.shape[0]
+        w = np.where(w0 > 0, w0, 0).astype(np.float64)
+        free = w > 0
+        scale = np.abs(cov).max() or 1
+        for _ in range(max_iter or 10 * n + 50):
+            f = np.flatnonzero(free)
+            g = cov.dot(w)
+            kkt = np.zeros((len(f) + n_eq,) * 2)
+            kkt[:len(f), :len(f)] = cov[np.ix_(f, f)]
+            kkt[:len(f), len(f):] = a[:, f].T
+            kkt[len(f):, :len(f)] = a[:, f]
+            rhs = np.concatenate([-g[f], np.zeros(n_eq)])
+            sol = np.linalg.lstsq(kkt, rhs, rcond=None)[0]
+            p = np.zeros(n)
+            p[f] = sol[:len(f)]
+            if np.abs(p).max() <= 1e-12 * (1 + np.abs(w).max()):
+                mu = g + a.T.dot(sol[len(f):])
+                mu[free] = np.inf
+                j = np.argmin(mu)
+                if mu[j] >= -1e-10 * scale:
+                    return w
+                free[j] = True
+            else:
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    steps = np.where(free & (p < 0), -w / p, np.inf)
+                j = np.argmin(steps)
+                w = w + min(1, steps[j]) * p
+                if steps[j] < 1:
+                    w[j] = 0
+                    free[j] = False
+        return None
+
+    def mef(self, n, er, cov, mode="qp"):
+        w = self.optimal_w(n, er, cov, mode)
         r = [self.port_r(w, er) for w in w]
         vol = [self.port_vol(w, cov) for w in w]
         return pd.DataFrame({"Return": r, "Volatility": vol})
@@ -201,19 +1116,14 @@ class Stats(object):
     def average_cor(self, fund, market, window=252):
         if (fund.name == "ROE") | (fund.name == "EWFL") | \
                 (fund.name == "CWFL") | (fund.name == "SP500"):
-                    f = fund.r.drop(["PAR"], axis=1)
+                    f = fund.names.drop(["PAR"])
         elif fund.name:
-            try:
-                f = fund.r.drop(["Portfolio"], axis=1)
-            except:
-                f = fund.r
-        f = f.dropna(how="all", axis=0)
+            f = fund.names.drop(["Portfolio"], errors="ignore")
+        f = fund.view(f, dropna=True)
         m = market.r["Paul"]
 
-        m_tr_r = m.rolling(window=window).agg(market.hz_r, mode="annualized")
-        f_tr_cor = f.rolling(window=window).corr()
-        f_tr_cor_mean = f_tr_cor.groupby(level="date"). \
-            apply(lambda cormat: np.nanmean(cormat.values))
+        m_tr_r = market.rolling_returns(m, window, mode="annualized")
+        f_tr_cor_mean = self.rolling_average_cor(f, window)
 
         corr_df = pd.DataFrame(OrderedDict({
                 "Average Correlation": f_tr_cor_mean,
@@ -227,33 +1137,85 @@ class Stats(object):
     def cppi(self, risky_r, safe_r=None, m=4, account0=100, floor_pct=0.80,
              rf=0.03, drawdown=None, start="1989", end="2049"):
         r = risky_r[start:end]
-        dates = r.index
-        n_step = len(dates)
-        port = account0
-        hurdle = account0
-        floor = account0 * floor_pct
-        peak = account0
         if isinstance(r, pd.Series):
             r = pd.DataFrame(r, columns=["R"])
         if safe_r is None:
-            s = pd.DataFrame().reindex_like(r)
-            s.values[:] = rf / self.ppy
+            s = pd.DataFrame(np.full(r.shape, rf / self.ppy),
+                             index=r.index, columns=r.columns)
+        else:
+            s = safe_r.reindex(r.index)
+            if isinstance(s, pd.Series):
+                s = pd.DataFrame(np.repeat(s.values[:, None], r.shape[1], 1),
+                                 index=r.index, columns=r.columns)
+
+        is_grid, grid, (m_v, floor_v, dd_v) = self.cppi_grid(m, floor_pct,
+                                                             drawdown)
+        bt = self.cppi_engine(r.values, s.values, m_v, floor_v, dd_v,
+                              account0)
+        if is_grid:
+            columns = pd.MultiIndex.from_tuples(
+                [g + (c,) for g in grid for c in r.columns],
+                names=["Risk Multiplier", "Floor Level", "Drawdown Level",
+                       r.columns.name])
         else:
-            np.nan
+            columns = r.columns
+        hist = {k: pd.DataFrame(v.reshape(len(r), -1), index=r.index,
+                                columns=columns) for k, v in bt.items()}
+
+        r_wealth = account0 * (1 + r).cumprod()
+
+        cppi_backtest = {
+                "CPPI Wealth": hist["port"],
+                "Risky Wealth": r_wealth,
+                "Hurdle": hist["hurdle"],
+                "Risk Budget": hist["cushion"],
+                "Risk Allocation": hist["r_w"],
+                "Initial Portfolio Value": account0,
+                "Risk Multiplier": m,
+                "Floor Level": floor_pct,
+                "Risky Portfolio": r,
+                "Safe Returns": s,
+                "Drawdown Level": drawdown,
+                "Peak": hist["peak"],
+                "Floor": hist["floor"],
+                "CPPI Stats": self.stats(hist["port"].pct_change()),
+                "Unconstrained Stats": self.stats(r_wealth.pct_change())}
+
+        return cppi_backtest
 
-        h = pd.DataFrame().reindex_like(r)
-        h.values[:] = (1.2)**(1/252) - 1
+    def cppi_grid(self, m, floor_pct, drawdown):
+        # scalars run a single configuration, list-likes span a grid
+        is_grid = any(np.ndim(x) > 0 for x in (m, floor_pct, drawdown))
+        grid = list(product(np.atleast_1d(m), np.atleast_1d(floor_pct),
+                            np.atleast_1d(np.array(drawdown, dtype=float))))
+        return is_grid, grid, [np.array(x, dtype=float) for x in zip(*grid)]
 
-        port_hist = pd.DataFrame().reindex_like(r)
-        r_w_hist = pd.DataFrame().reindex_like(r)
-        cushion_hist = pd.DataFrame().reindex_like(r)
-        peak_hist = pd.DataFrame().reindex_like(r)
-        floor_hist = pd.DataFrame().reindex_like(r)
-        hurdle_hist = pd.DataFrame().reindex_like(r)
+    def cppi_engine(self, r, s, m, floor_pct, drawdown, account0=100,
+                    history=True):
+        # r, s: (n_step, k) returns; m, floor_pct, drawdown: (p,) parameters
+        # with NaN drawdown meaning no drawdown constraint. The time loop is
+        # path dependent, every step is vectorized over p x k portfolios.
+        # Without history only the final state is kept, with whether each
+        # portfolio ever closed a step below its floor
+        n_step, k = r.shape
+        m = m[:, None]
+        has_dd = ~np.isnan(drawdown)[:, None]
+        dd = np.nan_to_num(drawdown)[:, None]
+        port = np.full((len(m), k), float(account0))
+        peak = port.copy()
+        floor = np.broadcast_to(account0 * floor_pct[:, None], port.shape)
+        h = np.full(n_step, (1.2)**(1/252) - 1)
 
+        hist = {x: np.empty((n_step,) + port.shape)
+                for x in ("port", "cushion", "r_w", "peak", "floor")
+                if history}
+        breach = np.zeros(port.shape, dtype=bool)
+        # a column starts at its first valid return: until then it holds its
+        # initial state and its history is NaN, as r is
+        started = np.zeros(k, dtype=bool)
         for step in range(n_step):
-            if drawdown is not None:
-                floor = peak * (1 - drawdown)
+            started |= ~np.isnan(r[step])
+            floor = np.where(has_dd, peak * (1 - dd), floor)
             peak = np.maximum(peak, port)
             cushion = (port - floor) / port
             r_w = m * cushion
@@ -263,36 +1225,181 @@ class Stats(object):
             r_alloc = port * r_w
             s_alloc = port * s_w
 
-            port = r_alloc * (1 + r.iloc[step]) + s_alloc * (1 + s.iloc[step])
-            hurdle = hurdle * (1 + h.iloc[step])
+            port = np.where(started, r_alloc * (1 + r[step]) +
+                            s_alloc * (1 + s[step]), port)
+            if not history:
+                breach |= port < floor
+                continue
 
-            cushion_hist.iloc[step] = cushion
-            r_w_hist.iloc[step] = r_w
-            port_hist.iloc[step] = port
-            floor_hist.iloc[step] = floor
-            peak_hist.iloc[step] = peak
-            hurdle_hist.iloc[step] = hurdle
+            for x, v in (("cushion", cushion), ("r_w", r_w), ("port", port),
+                         ("floor", floor), ("peak", peak)):
+                hist[x][step] = np.where(started, v, np.nan)
 
-        r_wealth = account0 * (1 + r).cumprod()
+        hurdle = np.cumprod(np.append(account0, 1 + h))[1:]
+        if not history:
+            return {"port": port, "floor": np.array(floor), "breach": breach,
+                    "hurdle": hurdle[-1] if n_step else float(account0)}
+        hist["hurdle"] = np.tile(hurdle[:, None, None], (1,) + port.shape)
+        return hist
 
-        cppi_backtest = {
-                "CPPI Wealth": port_hist,
-                "Risky Wealth": r_wealth,
-                "Hurdle": hurdle_hist,
-                "Risk Budget": cushion_hist,
-                "Risk Allocation": r_w_hist,
-                "Initial Portfolio Value": account0,
-                "Risk Multiplier": m,
-                "Floor Level": floor_pct,
-                "Risky Portfolio": r,
-                "Safe Returns": s,
-                "Drawdown Level": drawdown,
-                "Peak": peak_hist,
-                "Floor": floor_hist,
-                "CPPI Stats": self.stats(port_hist.pct_change()),
-                "Unconstrained Stats": self.stats(r_wealth.pct_change())}
+    def mc_cppi(self, n_years=10, n_scenarios=10000, m=4, floor_pct=0.80,
+                drawdown=None, rf=0.03, account0=100, mode="gbm", mu=7,
+                sigma=15, entity="PAR", block_len=21, resample="stationary",
+                seed=None, block=2000,
+                quantiles=(0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99)):
+        # the CPPI rule over simulated risky returns, mode "gbm" drawing
+        # gbm's normal returns and "bootstrap" resampling entity's returns
+        # through bootstrap_index; scenarios run block by block through
+        # cppi_engine without history, each block with its own spawned
+        # generator
+        if mode not in SCENARIO_MODES:
+            raise ValueError("unknown scenario mode: " + str(mode) +
+                             ", expected one of " + ", ".join(SCENARIO_MODES))
+        n_steps = int(n_years * self.ppy)
+        drift, vol = mu / 100 / self.ppy, sigma / 100 / np.sqrt(self.ppy)
+        if mode == "bootstrap":
+            x0 = self.column(entity).values
+        is_grid, grid, (m_v, floor_v, dd_v) = self.cppi_grid(m, floor_pct,
+                                                             drawdown)
+        starts = range(0, n_scenarios, block)
+        seeds = np.random.SeedSequence(seed).spawn(len(starts))
+        port, floor = np.empty((2, len(grid), n_scenarios))
+        breach = np.empty((len(grid), n_scenarios), dtype=bool)
+        for i, x in zip(starts, seeds):
+            j = min(i + block, n_scenarios)
+            rng = np.random.default_rng(x)
+            if mode == "gbm":
+                r = drift + vol * rng.standard_normal((n_steps, j - i))
+            elif mode == "bootstrap":
+                r = x0[self.bootstrap_index(rng, len(x0), n_steps, j - i,
+                                            block_len, resample)]
+            s = np.broadcast_to(rf / self.ppy, r.shape)
+            out = self.cppi_engine(r, s, m_v, floor_v, dd_v, account0,
+                                   history=False)
+            port[:, i:j], floor[:, i:j] = out["port"], out["floor"]
+            breach[:, i:j] = out["breach"]
 
-        return cppi_backtest
+        # EDHEC-style floor violation: terminal wealth below the floor in
+        # force at the end, with the expected shortfall over violations
+        violated = port < floor
+        n_violated = violated.sum(axis=1)
+        with np.errstate(invalid="ignore"):
+            shortfall = np.where(violated, port - floor, 0).sum(axis=1) / \
+                n_violated
+        names = ["Risk Multiplier", "Floor Level", "Drawdown Level"]
+        configs = pd.MultiIndex.from_tuples(grid, names=names)
+        summary = pd.DataFrame(OrderedDict({
+            "Mean Terminal Wealth": port.mean(axis=1),
+            "Floor Violation Probability": n_violated / n_scenarios,
+            "Expected Shortfall": np.where(n_violated > 0, shortfall, 0),
+            "Floor Breach Probability": breach.mean(axis=1),
+            "Hurdle Probability": (port >= out["hurdle"]).mean(axis=1)
+                }), index=configs)
+        terminal = pd.DataFrame(port.T, columns=configs)
+        mc = OrderedDict({
+            "Terminal Wealth": terminal,
+            "Quantiles": terminal.quantile(list(quantiles)),
+            "Summary": summary})
+        if not is_grid:
+            mc = OrderedDict((k, v.iloc[:, 0] if k != "Summary"
+                              else v.iloc[0]) for k, v in mc.items())
+        return mc
+
+    def cppi_cube(self, risky_r, m, floor_pct, drawdown, start="1989",
+                  end="2049", rf=0.03, account0=100):
+        bt = self.cppi(risky_r, None, list(m), account0, list(floor_pct),
+                       rf, list(drawdown), start, end)
+        cube = bt["CPPI Stats"]
+        cube.insert(0, "Terminal Wealth",
+                    bt["CPPI Wealth"].ffill().iloc[-1].reindex(cube.index))
+        cube.insert(0, "Start Date", start)
+        return cube.set_index("Start Date", append=True)
+
+    def cppi_sweep(self, risky_r, m=(2, 3, 4, 5), floor_pct=(0.7, 0.8, 0.9),
+                   drawdown=(None, 0.1, 0.2), start=("1989",), end="2049",
+                   rf=0.03, account0=100, n_workers=None):
+        # tasks are start dates x risk multipliers x column chunks, each a
+        # floor by drawdown grid over some managers, with the columns cut
+        # finely enough to give every worker a few tasks
+        risky_r = risky_r.astype(np.float64)
+        m = list(np.atleast_1d(m))
+        n_workers = n_workers or os.cpu_count() or 1
+        k = risky_r.shape[1]
+        n_chunks = min(k, max(1, -(-2 * n_workers // (len(start) * len(m)))))
+        cuts = np.linspace(0, k, n_chunks + 1).astype(int)
+        tasks = [(x, [y], (i, j)) for x in start for y in m
+                 for i, j in zip(cuts[:-1], cuts[1:]) if j > i]
+        if n_workers == 1 or len(tasks) == 1:
+            cubes = [self.cppi_cube(risky_r, m, floor_pct, drawdown, x, end,
+                                    rf, account0) for x in start]
+        else:
+            # the returns matrix goes to the workers once, through shared
+            # memory; each task only pickles its labels and parameters
+            values = np.ascontiguousarray(risky_r.values)
+            shm = shared_memory.SharedMemory(create=True, size=values.nbytes)
+            try:
+                np.ndarray(values.shape, values.dtype, shm.buf)[:] = values
+                spec = (shm.name, values.shape, risky_r.index,
+                        risky_r.columns, self.f, self.name, self.rf,
+                        self.var_lev)
+                tasks = [(spec, y, floor_pct, drawdown, x, end, rf, account0,
+                          cols) for x, y, cols in tasks]
+                with ProcessPoolExecutor(max_workers=n_workers) as pool:
+                    cubes = list(pool.map(cppi_sweep_task, tasks))
+            finally:
+                shm.close()
+                shm.unlink()
+        cube = pd.concat(cubes)
+        # one row per manager with returns in the horizon and configuration
+        n_config = len(m) * np.size(floor_pct) * np.size(drawdown)
+        expected = n_config * sum(risky_r[x:end].notna().any().sum()
+                                  for x in start)
+        if len(cube) != expected:
+            raise RuntimeError("cppi sweep returned " + str(len(cube)) +
+                               " rows, expected " + str(expected))
+        return cube.reorder_levels([3, 0, 1, 2, 4]).sort_index()
+
+    def cppi_rank(self, cube, by=("Annualized Sharpe Ratio", "Max Drawdown")):
+        level = cube.index.names[0]
+        ranked = cube.sort_values([level] + list(by),
+                                  ascending=[True] + [False] * len(by))
+        ranked.insert(0, "Rank", ranked.groupby(level=level).cumcount() + 1)
+        return ranked
+
+    def bootstrap(self, n_steps, n_scenarios, columns=None, block_len=21,
+                  mode="stationary", seed=None):
+        # resampled returns as a (n_steps, n_scenarios) frame per column,
+        # ready for stats() or a Stats object, with a scenario column for
+        # rolling_var; every column is gathered with the same row draws from
+        # the horizon, so the cross-section's correlations are kept, and
+        # rows where every selected column is NaN are never drawn. A single
+        # column label returns its frame, a list an OrderedDict of frames
+        one = columns is not None and np.ndim(columns) == 0
+        r = self.view([columns] if one else columns)
+        a = r.values[~np.isnan(r.values).all(axis=1)]
+        idx = self.bootstrap_index(np.random.default_rng(seed), len(a),
+                                   n_steps, n_scenarios, block_len, mode)
+        paths = OrderedDict((x, pd.DataFrame(a[:, c][idx]))
+                            for c, x in enumerate(r.columns))
+        return paths[columns] if one else paths
+
+    def bootstrap_index(self, rng, n_rows, n_steps, n, block_len=21,
+                        mode="stationary"):
+        # row positions (n_steps, n) into n_rows rows. "block" chains fixed
+        # blocks of block_len consecutive rows; "stationary" starts a new
+        # block at a random row with probability 1 / block_len at each step
+        # and wraps past the last row, so block lengths are geometric
+        t = np.arange(n_steps)[:, None]
+        if mode == "block":
+            block_len = min(block_len, n_rows)
+            start = rng.integers(0, n_rows - block_len + 1,
+                                 (-(-n_steps // block_len), n))
+            return start[t[:, 0] // block_len] + t % block_len
+        new = rng.random((n_steps, n)) < 1 / block_len
+        new[:1] = True
+        start = rng.integers(0, n_rows, (n_steps, n))
+        last = np.maximum.accumulate(np.where(new, t, 0), axis=0)
+        return (np.take_along_axis(start, last, axis=0) + t - last) % n_rows
 
     def gbm(self, n_years=1, n_scenarios=10, mu=7, sigma=15,
             frequency="daily", price0=100):
@@ -308,6 +1415,69 @@ class Stats(object):
         prices = price0*(1+rets).cumprod()
         return prices
 
+# ******************************** MONTE CARLO ********************************
+    def mc_gbm(self, n_years=10, n_scenarios=100000, mu=7, sigma=15,
+               frequency="daily", price0=100, floor_pct=0.80, seed=None,
+               block=10000, chunk=252,
+               quantiles=(0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99),
+               paths=False, n_workers=1, n_bins=4000):
+        # gbm's model in blocks of scenarios, each drawing from its own
+        # generator spawned off seed and reduced where it ran to tallies,
+        # sums and histograms on shared bin edges, so results depend on
+        # neither chunk nor n_workers and no per-path state comes back
+        # unless paths are asked for. Quantiles are read off the merged
+        # histograms and are exact to within a bin
+        steps_per_year = PPY[frequency]
+        dt = 1 / steps_per_year
+        drift, vol = mu / 100 * dt, sigma / 100 * np.sqrt(dt)
+        n_steps = int(n_years * steps_per_year)
+        # log-wealth bins span 12 standard deviations around its mean, far
+        # enough out that clipping into the end bins never moves a quantile
+        centre = n_steps * (np.log1p(drift) - vol**2 / 2)
+        spread = 12 * vol * np.sqrt(max(n_steps, 1))
+        edges = np.linspace(centre - spread, centre + spread, n_bins + 1)
+        dd_edges = np.linspace(-1, 0, n_bins + 1)
+        starts = range(0, n_scenarios, block)
+        seeds = np.random.SeedSequence(seed).spawn(len(starts))
+        tasks = [(x, n_steps, min(block, n_scenarios - i), drift, vol, chunk,
+                  np.log(floor_pct), edges, dd_edges, paths)
+                 for i, x in zip(starts, seeds)]
+        pool = ProcessPoolExecutor(max_workers=n_workers) \
+            if n_workers != 1 and len(tasks) > 1 else None
+        wealth, breach = 0.0, 0
+        w_hist, dd_hist = np.zeros((2, n_bins), dtype=np.int64)
+        prices = np.empty((n_steps, n_scenarios)) if paths else None
+        with pool or nullcontext():
+            # partial aggregates are merged in block order, whichever
+            # worker ran the block
+            results = (pool.map if pool else map)(gbm_block_task, tasks)
+            for i, (agg, out) in zip(starts, results):
+                wealth += agg[0]
+                breach += agg[1]
+                w_hist += agg[2]
+                dd_hist += agg[3]
+                if paths:
+                    prices[:, i:i + out.shape[1]] = out
+
+        mc = OrderedDict({
+            "Terminal": pd.Series(w_hist, index=price0 * np.exp(
+                (edges[1:] + edges[:-1]) / 2), name="Scenarios"),
+            "Mean Terminal": price0 * wealth / n_scenarios,
+            "Quantiles": pd.Series(price0 * np.exp(self.hist_quantile(
+                edges, w_hist, quantiles)), index=quantiles),
+            "Max Drawdown": pd.Series(self.hist_quantile(
+                dd_edges, dd_hist, quantiles), index=quantiles),
+            "Breach Probability": breach / n_scenarios})
+        if paths:
+            mc["Paths"] = pd.DataFrame(price0 * prices)
+        return mc
+
+    def hist_quantile(self, edges, counts, quantiles):
+        # quantiles of the values binned into counts, interpolated linearly
+        # within the bin each one falls in
+        cum = np.append(0, np.cumsum(counts))
+        return np.interp(np.asarray(quantiles) * cum[-1], cum, edges)
+
 # ****************************** TIME INFORMATION *****************************
     def get_hz(self, r: pd.Series, mode="min"):
         self.check_instance(r, "pd.Series", "get_hz")
@@ -323,3 +1493,54 @@ class Stats(object):
         if type == "pd.Series":
             if not isinstance(r, pd.Series):
                 raise TypeError(fun + "() can only take a pandas Series")
+
+
+def cppi_sweep_task(task):
+    spec, m, floor_pct, drawdown, start, end, rf, account0, cols = task
+    shm_name, shape, index, columns, f, name, rfr, var_lev = spec
+    shm = shared_memory.SharedMemory(name=shm_name)
+    values = np.ndarray(shape, np.float64, shm.buf)
+    r = pd.DataFrame(values[:, cols[0]:cols[1]], index=index,
+                     columns=columns[cols[0]:cols[1]], copy=False)
+    cube = Stats(r, f, name, rfr, var_lev).cppi_cube(
+        r, m, floor_pct, drawdown, start, end, rf, account0)
+    del r, values
+    shm.close()
+    return cube
+
+
+def gbm_block(seed, n_steps, n, drift, vol, chunk=252, out=None):
+    # streams n paths through time chunk steps at a time in log-space,
+    # carrying log-wealth, its running peak, the deepest log drawdown and
+    # the lowest log-wealth; the first step is the starting price
+    rng = np.random.default_rng(seed)
+    log_w, peak, dd, low = np.zeros((4, n))
+    for t in range(0, n_steps, chunk):
+        r = drift + vol * rng.standard_normal((min(chunk, n_steps - t), n))
+        if t == 0:
+            r[0] = 0
+        # seeding the first row with the carried log-wealth keeps the
+        # running sum's order, and so its rounding, independent of chunk
+        path = np.log1p(r)
+        path[0] += log_w
+        path = np.cumsum(path, axis=0)
+        run = np.maximum(peak, np.maximum.accumulate(path, axis=0))
+        dd = np.minimum(dd, (path - run).min(axis=0))
+        low = np.minimum(low, path.min(axis=0))
+        log_w, peak = path[-1], run[-1]
+        if out is not None:
+            out[t:t + len(r)] = np.exp(path)
+    return log_w, low, dd
+
+
+def gbm_block_task(task):
+    # one block of mc_gbm, reduced to its terminal wealth sum, floor
+    # breaches and log-wealth and drawdown histogram counts
+    seed, n_steps, n, drift, vol, chunk, log_floor, edges, dd_edges, \
+        paths = task
+    out = np.empty((n_steps, n)) if paths else None
+    log_w, low, dd = gbm_block(seed, n_steps, n, drift, vol, chunk, out)
+    agg = (np.exp(log_w).sum(), int((low < log_floor).sum()),
+           np.histogram(np.clip(log_w, edges[0], edges[-1]), edges)[0],
+           np.histogram(np.expm1(dd), dd_edges)[0])
+    return agg, out
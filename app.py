@@ -1,12 +1,30 @@
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
+import par_stats as ps
+import snapshot_scripts as snp
 from flask import Flask
 
+# memory-mapped once at startup as of the loaded data, rebuilt first if it
+# is stale; pages only look rows up
+SNAPSHOT = ps.current_snapshot("roe")
+COLS = ["Cumulative Return", "Annualized Return", "Annualized Volatility",
+        "Max Drawdown"]
+
+
+def stats_table(horizon="Inception", cols=COLS):
+    table = snp.lookup_stats(SNAPSHOT, horizon=horizon)[cols]
+    return html.Table(
+        [html.Tr([html.Th(table.index.name)] + [html.Th(x) for x in cols])] +
+        [html.Tr([html.Td(entity)] +
+                 [html.Td("{:.2%}".format(x)) for x in row])
+         for entity, row in table.iterrows()])
+
+
 server = Flask(__name__)
 app = dash.Dash(__name__, server=server)
 
-app.layout = html.Div(children=[html.H1("Hello World")])
+app.layout = html.Div(children=[html.H1("Hello World"), stats_table()])
 
 if __name__ == "__main__":
     app.run_server()
\ No newline at end of file
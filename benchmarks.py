@@ -0,0 +1,192 @@
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+import numpy as np
+import pandas as pd
+import cache_scripts as cch
+from timeit import default_timer as timer
+from itertools import product
+from Stats import Stats
+
+TMP = "./temp-data-sources/"
+
+
+def random_universe(n_assets, n_obs=1000, seed=0):
+    rng = np.random.default_rng(seed)
+    mix = rng.standard_normal((n_assets, n_assets)) / np.sqrt(n_assets)
+    r = rng.standard_normal((n_obs, n_assets)).dot(mix) * 0.01 + 0.0003
+    r = pd.DataFrame(r, columns=["A" + str(x) for x in range(n_assets)])
+    s = Stats(r, "daily", "BENCH")
+    er = pd.Series(rng.uniform(0.0, 0.2, n_assets), index=r.columns)
+    return s, er, r.cov()
+
+
+def timed(fun, *args, **kwargs):
+    t0 = timer()
+    fun(*args, **kwargs)
+    return timer() - t0
+
+
+# ****************************** OPTIMIZERS ***********************************
+def bench_optimizers(sizes=(10, 50, 200)):
+    rows = []
+    for n in sizes:
+        s, er, cov = random_universe(n)
+        chol = np.linalg.cholesky(cov.values)
+        target_er = er.median()
+        for fun, args in (("minimize_vol", (target_er, er, cov)),
+                          ("msr", (er, cov)), ("gmv", (cov,))):
+            kw = {} if fun == "minimize_vol" else {"mode": "slsqp"}
+            opt = getattr(s, fun)
+            rows.append({
+                "Assets": n,
+                "Optimizer": fun,
+                "Numerical": timed(opt, *args, jac=False, **kw),
+                "Analytic": timed(opt, *args, jac=True, **kw),
+                "Analytic + Cholesky": timed(opt, *args, jac=True,
+                                             chol=chol, **kw)})
+    bench = pd.DataFrame(rows).set_index(["Assets", "Optimizer"])
+    bench["Speedup"] = bench["Numerical"] / bench["Analytic + Cholesky"]
+    return bench
+
+
+# ******************************** DATA LOADS *********************************
+def bench_load(sources=(("manager_roes.csv", pd.read_csv, 0),
+                        ("benchmark_data.xlsx", pd.read_excel, 1),
+                        ("focus_list_prices_and_market_caps_abridged.xlsx",
+                         pd.read_excel, 1))):
+    rows = []
+    cache_path = tempfile.mkdtemp()
+    try:
+        for src, reader, index_col in sources:
+            path = os.path.join(TMP, src)
+            kw = {"header": 0, "index_col": index_col, "parse_dates": True}
+            rows.append({
+                "Source": src,
+                "Cold": timed(cch.read_cached, path, reader, cache_path, **kw),
+                "Warm": timed(cch.read_cached, path, reader, cache_path,
+                              **kw)})
+    finally:
+        shutil.rmtree(cache_path)
+    bench = pd.DataFrame(rows).set_index("Source")
+    bench["Speedup"] = bench["Cold"] / bench["Warm"]
+    return bench
+
+
+# ********************************** MEMORY ***********************************
+def peak_rss():
+    # peak resident set size in MB; ru_maxrss is in KB on Linux
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    except ImportError:
+        import psutil
+        return psutil.Process().memory_info().peak_wset / 2**20
+
+
+def memory_task(mode, n_obs, n_assets, horizons=range(1996, 2010, 2)):
+    # stocks list on staggered dates, so every column has leading NaNs like
+    # the pct_change'd stock universe; the universe is filled column by
+    # column so building it leaves no transient peak, and the slices are
+    # held as charts would hold them
+    rng = np.random.default_rng(0)
+    r = np.empty((n_obs, n_assets), order="F")
+    for x, listed in enumerate(rng.integers(0, n_obs // 2, n_assets)):
+        r[:, x] = rng.standard_normal(n_obs) * 0.01
+        r[:listed, x] = np.nan
+    r = pd.DataFrame(r, index=pd.bdate_range("1995-01-02", periods=n_obs),
+                     columns=["S" + str(x) for x in range(n_assets)],
+                     copy=False)
+    s = Stats(r, "daily", "BENCH")
+    del r
+    rss0 = peak_rss()
+    held = []
+    for start in map(str, horizons):
+        s.change_hz(start)
+        if mode == "copy":
+            held.append(s.r.drop([s.names[0]], axis=1).dropna(how="all"))
+            held.extend(s.r0[x][start:].dropna() for x in s.names)
+        else:
+            held.append(s.view(s.names.drop([s.names[0]]), dropna=True))
+            held.extend(s.column(x, start) for x in s.names)
+    print(rss0, peak_rss())
+
+
+def bench_memory(n_obs=5000, n_assets=1000):
+    # each mode runs in a fresh interpreter so peaks do not carry over
+    rows = []
+    for mode in ("copy", "view"):
+        task = "import benchmarks as bm; bm.memory_task({!r}, {}, {})"
+        out = subprocess.run([sys.executable, "-c",
+                              task.format(mode, n_obs, n_assets)],
+                             cwd=os.path.dirname(os.path.abspath(__file__)),
+                             capture_output=True, text=True, check=True)
+        rss0, rss1 = map(float, out.stdout.split()[-2:])
+        rows.append({"Mode": mode, "Baseline MB": rss0, "Peak MB": rss1,
+                     "Growth MB": rss1 - rss0})
+    return pd.DataFrame(rows).set_index("Mode")
+
+
+def storage_task(storage, dtype, n_obs, n_assets):
+    # the universe is built column by column and dropped once stored, so
+    # the growth past that peak is what stats and the column reads add
+    rng = np.random.default_rng(0)
+    r = np.empty((n_obs, n_assets), order="F")
+    for x, listed in enumerate(rng.integers(0, n_obs, n_assets)):
+        r[:, x] = rng.standard_normal(n_obs) * 0.01
+        r[:listed, x] = np.nan
+    r = pd.DataFrame(r, index=pd.bdate_range("1995-01-02", periods=n_obs),
+                     copy=False)
+    s = Stats(r, "daily", "BENCH", storage=storage, dtype=dtype)
+    del r
+    import scipy.stats
+    rss0 = peak_rss()
+    t = timed(s.stats)
+    for x in s.names:
+        s.rolling_moments(s.column(x))
+    print(s.values.nbytes / 2**20, rss0, peak_rss(), t)
+
+
+def bench_storage(n_obs=5000, n_assets=1000):
+    # each layout runs in a fresh interpreter so peaks do not carry over
+    rows = []
+    for storage, dtype in product(("dense", "ragged"),
+                                  ("float64", "float32")):
+        task = "import benchmarks as bm; bm.storage_task({!r}, {!r}, {}, {})"
+        out = subprocess.run([sys.executable, "-c",
+                              task.format(storage, dtype, n_obs, n_assets)],
+                             cwd=os.path.dirname(os.path.abspath(__file__)),
+                             capture_output=True, text=True, check=True)
+        mb, rss0, rss1, t = map(float, out.stdout.split()[-4:])
+        rows.append({"Storage": storage, "Dtype": dtype, "Buffer MB": mb,
+                     "Baseline MB": rss0, "Peak MB": rss1,
+                     "Growth MB": rss1 - rss0, "Stats": t})
+    return pd.DataFrame(rows).set_index(["Storage", "Dtype"])
+
+
+# ******************************** MONTE CARLO ********************************
+def bench_mc(workers=(1, 2, 4, 8), n_years=1, n_scenarios=400000):
+    s = Stats(pd.DataFrame(), "daily", "BENCH")
+    rows, ref = [], None
+    for n in workers:
+        t0 = timer()
+        mc = s.mc_gbm(n_years, n_scenarios, seed=0, n_workers=n)
+        t = timer() - t0
+        ref = mc["Quantiles"].values if ref is None else ref
+        rows.append({"Workers": n, "Seconds": t,
+                     "Identical": np.array_equal(mc["Quantiles"].values,
+                                                 ref)})
+    bench = pd.DataFrame(rows).set_index("Workers")
+    bench["Speedup"] = bench["Seconds"].iloc[0] / bench["Seconds"]
+    return bench
+
+
+if __name__ == "__main__":
+    pd.set_option("display.width", 120)
+    print(bench_optimizers())
+    print(bench_load())
+    print(bench_memory())
+    print(bench_storage())
+    print(bench_mc())
@@ -1,6 +1,7 @@
 import pandas as pd
 import numpy as np
 import db_scripts as dbs
+import snapshot_scripts as snp
 from Stats import Stats
 from bokeh.io import curdoc
 from bokeh.plotting import figure, output_file, show, ColumnDataSource
@@ -26,16 +27,10 @@ roe = Stats(roe, "daily", "ROE")
 test = Stats(pd.DataFrame({}), "daily", "TEST")
 
 TGP = pd.Series([roe])
+TGP.apply(lambda x: x.fill_gaps())
 
-
-def fillgaps(data):
-    s = []
-    data.r.apply(lambda col: s.append(col.loc[col.first_valid_index():
-                                      col.last_valid_index()].fillna(0)))
-    data.r = pd.DataFrame(s).transpose()
-    data.r0 = pd.DataFrame(s).transpose()
-
-TGP.apply(lambda x: fillgaps(x))
+# precomputed by par_stats.build_snapshots; ignored once the data moves on
+SNAPSHOT = snp.load_snapshot("roe", roe.max_date)
 
 
 def bokeh_ts(source, col, title, xlab="", ylab="", width=500, height=300,
@@ -81,7 +76,7 @@ def chart_stats(entity="PAR", obj=roe, window=252, start=1989, end=2049,
     s = obj
     start = str(start)
     end = str(end)
-    r = s.r0[entity][start:end].dropna()
+    r = s.column(entity, start, end)
     begin = r.index.min().strftime("%m/%d/%Y")
     finish = r.index.max().strftime("%m/%d/%Y")
     n = str(r.count())
@@ -95,16 +90,15 @@ def chart_stats(entity="PAR", obj=roe, window=252, start=1989, end=2049,
     title_kurt = entity + " " + s.name + " - Kurtosis " + \
         "(" + begin + " - " + finish + ", " + n + " observations)"
 
-    roll_vol = r.rolling(window).apply(lambda x, mode="annualized":
-        s.hz_vol(x, mode))
-
-    roll_skew = r.rolling(window).apply(lambda x: s.skewness(x))
-
-    roll_kurt = r.rolling(window).apply(lambda x: s.kurtosis(x))
+    roll = None
+    if s is roe and (start, end) == ("1989", "2049"):
+        roll = snp.lookup_rolling(SNAPSHOT, entity, window, var_lev)
+    if roll is None:
+        roll = s.rolling_moments(r, window, vol_mode="annualized")
 
-    stats_df = pd.DataFrame({"Vol": roll_vol,
-                             "Skew": roll_skew,
-                             "Kurt": roll_kurt})
+    stats_df = pd.DataFrame({"Vol": roll["Volatility"],
+                             "Skew": roll["Skewness"],
+                             "Kurt": roll["Kurtosis"]})
     stats_source = ColumnDataSource(stats_df)
 
     vol = bokeh_ts(stats_source, "Vol", title_vol)
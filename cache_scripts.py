@@ -0,0 +1,119 @@
+import os
+import json
+import hashlib
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as ft
+
+CACHE_PATH = "./cache/"
+STORE_PATH = "./cache/stores/"
+META_KEY = b"nrp_source"
+
+
+def source_hash(path, block=1 << 20):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(block), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def cache_file(path, cache_path=CACHE_PATH):
+    # same-named sources in different directories get their own files
+    key = hashlib.sha1(os.path.realpath(path).encode()).hexdigest()[:12]
+    return os.path.join(cache_path,
+                        os.path.basename(path) + "." + key + ".feather")
+
+
+def read_cache_meta(path):
+    try:
+        meta = ft.read_table(path, memory_map=True).schema.metadata or {}
+        return json.loads(meta[META_KEY])
+    except (OSError, KeyError, ValueError, pa.ArrowInvalid):
+        return None
+
+
+def write_cache(df, path, meta):
+    table = pa.Table.from_pandas(df)
+    schema_meta = dict(table.schema.metadata or {})
+    schema_meta[META_KEY] = json.dumps(meta).encode()
+    table = table.replace_schema_metadata(schema_meta)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    # uncompressed feather so later loads can memory-map it
+    ft.write_feather(table, path + ".tmp", compression="uncompressed")
+    os.replace(path + ".tmp", path)
+
+
+def read_cached(path, reader, cache_path=CACHE_PATH, **kwargs):
+    # the cache is valid while the source's mtime and size are unchanged, or
+    # when a touched source still hashes the same; the reader's arguments
+    # are part of the key since they change the frame that gets built
+    st = os.stat(path)
+    args = json.dumps(kwargs, sort_keys=True, default=str)
+    target = cache_file(path, cache_path)
+    meta = read_cache_meta(target)
+
+    if meta is not None and meta["args"] == args:
+        hit = (meta["mtime"], meta["size"]) == (st.st_mtime, st.st_size)
+        if not hit and meta["size"] == st.st_size:
+            hit = meta["sha1"] == source_hash(path)
+            if hit:
+                meta["mtime"] = st.st_mtime
+                write_cache(load_cache(target), target, meta)
+        if hit:
+            return load_cache(target)
+
+    df = reader(path, **kwargs)
+    meta = {"mtime": st.st_mtime, "size": st.st_size,
+            "sha1": source_hash(path), "args": args}
+    try:
+        write_cache(df, target, meta)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        pass
+    return df
+
+
+def load_cache(path):
+    return ft.read_table(path, memory_map=True).to_pandas()
+
+
+def store_file(name, store_path=STORE_PATH):
+    return os.path.join(store_path, name + ".feather")
+
+
+def read_store(name, store_path=STORE_PATH):
+    path = store_file(name, store_path)
+    return load_cache(path) if os.path.exists(path) else None
+
+
+def write_store(df, name, store_path=STORE_PATH, meta=None):
+    meta = dict(meta or {}, store=name)
+    write_cache(df, store_file(name, store_path), meta)
+
+
+def read_store_meta(name, store_path=STORE_PATH):
+    return read_cache_meta(store_file(name, store_path))
+
+
+def part_file(name, key, store_path=STORE_PATH):
+    return os.path.join(store_path, name, str(key) + ".feather")
+
+
+def read_parts(name, store_path=STORE_PATH):
+    # a partitioned store is a directory of one Feather file per key, read
+    # back in key order; None until its first partition is written
+    path = os.path.join(store_path, name)
+    keys = sorted(x[:-len(".feather")] for x in os.listdir(path)
+                  if x.endswith(".feather")) if os.path.isdir(path) else []
+    if not keys:
+        return None
+    return pd.concat([load_cache(part_file(name, x, store_path))
+                      for x in keys])
+
+
+def write_parts(df, name, store_path=STORE_PATH, key=lambda x: x.year):
+    # rewrites only the partitions df's rows fall in, by default the years
+    # of its date index, each from the rows df holds for it
+    for k, part in df.groupby(key(df.index), sort=True):
+        write_cache(part, part_file(name, k, store_path),
+                    {"store": name, "part": str(k)})
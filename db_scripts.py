@@ -1,43 +1,135 @@
-import pyodbc
+import sqlite3
+import threading
 import pandas as pd
 import numpy as np
+from contextlib import contextmanager
+from queue import LifoQueue, Empty, Full
+
+try:
+    import pyodbc
+except ImportError:
+    pyodbc = None
+
+SERVER = "parcap-sql01"
+DBS = {"pmd": "par_masterdata",
+       "pbi": "par_bi",
+       "psg": "par_stage",
+       "lgy": "par"}
+POOL_SIZE = 4
+CHUNK_SIZE = 100000
+
+
+def odbc_cnx(db):
+    return pyodbc.connect("Driver={SQL Server};"
+                          "Server=" + SERVER + ";"
+                          "Database=" + DBS[db] + ";"
+                          "Trusted_Connection=yes;")
+
+
+def sqlite_cnx(db, path="{db}.sqlite"):
+    return sqlite3.connect(path.format(db=db, name=DBS[db]),
+                           check_same_thread=False)
+
+
+BACKENDS = {"pyodbc": odbc_cnx, "sqlite": sqlite_cnx}
+# sqlite has no three-part names, so each backend maps the tables the
+# queries below use to its own names; a sqlite alias is one file per DBS key
+TABLES = {"pyodbc": {"trx": "par_masterdata.fact.transactions",
+                     "roe": "par_bi.dbo.manager_roes"},
+          "sqlite": {"trx": "transactions",
+                     "roe": "manager_roes"}}
+BACKEND = {"name": "pyodbc", "options": {}}
+POOL = {}
+POOL_LOCK = threading.Lock()
+
+
+def set_backend(name, tables=None, **options):
+    # e.g. set_backend("sqlite", path="./qa-data-sources/{db}.sqlite");
+    # tables overrides entries of the backend's TABLES mapping
+    if name not in BACKENDS:
+        raise ValueError("unknown database backend: " + name)
+    close_db_cnx()
+    BACKEND["name"] = name
+    BACKEND["options"] = options
+    TABLES[name] = dict(TABLES[name], **(tables or {}))
+
+
+def table_stmt(stmt):
+    # fills {trx}-style table keys with the current backend's names
+    return stmt.format(**TABLES[BACKEND["name"]])
+
 
 def open_db_cnx(db):
-    if db == "pmd":
-        cnx = pyodbc.connect("Driver={SQL Server};"
-                             "Server=parcap-sql01;"
-                             "Database=par_masterdata;"
-                             "Trusted_Connection=yes;")
-    if db == "pbi":
-        cnx = pyodbc.connect("Driver={SQL Server};"
-                             "Server=parcap-sql01;"
-                             "Database=par_bi;"
-                             "Trusted_Connection=yes;")
-    if db == "psg":
-        cnx = pyodbc.connect("Driver={SQL Server};"
-                             "Server=parcap-sql01;"
-                             "Database=par_stage;"
-                             "Trusted_Connection=yes;")
-    if db == "lgy":
-        cnx = pyodbc.connect("Driver={SQL Server};"
-                             "Server=parcap-sql01;"
-                             "Database=par;"
-                             "Trusted_Connection=yes;")
-
-    return cnx
-
-def get_db_data(stmt, db):
-    cnx = open_db_cnx(db)
-    df = pd.read_sql(stmt, cnx)
-    cnx.close()
-    return df
+    if db not in DBS:
+        raise ValueError("unknown database alias: " + db)
+    return BACKENDS[BACKEND["name"]](db, **BACKEND["options"])
+
+
+def close_db_cnx(db=None):
+    with POOL_LOCK:
+        aliases = [db] if db else list(POOL)
+        pools = [POOL.pop(x) for x in aliases if x in POOL]
+    for pool in pools:
+        while not pool.empty():
+            pool.get_nowait().close()
+
+
+@contextmanager
+def db_cnx(db):
+    # connections go back to their alias' pool after a clean exit and are
+    # dropped after an error or an abandoned stream, which may leave them
+    # with pending results
+    with POOL_LOCK:
+        pool = POOL.setdefault(db, LifoQueue(maxsize=POOL_SIZE))
+    try:
+        cnx = pool.get_nowait()
+    except Empty:
+        cnx = open_db_cnx(db)
+    try:
+        yield cnx
+    except BaseException:
+        cnx.close()
+        raise
+    try:
+        pool.put_nowait(cnx)
+    except Full:
+        cnx.close()
+
+
+def get_db_data(stmt, db, params=None, chunksize=None):
+    if chunksize is not None:
+        return stream_db_data(stmt, db, params, chunksize)
+    with db_cnx(db) as cnx:
+        return pd.read_sql(stmt, cnx, params=params)
 
-sql = ({"trx": ("select * from par_masterdata.fact.transactions",
-                "lgy")
+
+def stream_db_data(stmt, db, params=None, chunksize=CHUNK_SIZE):
+    with db_cnx(db) as cnx:
+        for chunk in pd.read_sql(stmt, cnx, params=params,
+                                 chunksize=chunksize):
+            yield chunk
+
+sql = ({"trx": ("select * from {trx}",
+                "lgy"),
+        "roe": ("select * from {roe}",
+                "pbi")
         })
 
-def get_par_db_transactions(s=sql["trx"]):
-    return get_db_data(s[0], s[1])
+def get_par_db_transactions(s=sql["trx"], chunksize=None):
+    return get_db_data(table_stmt(s[0]), s[1], chunksize=chunksize)
+
+
+def get_manager_roes(since=None, s=sql["roe"]):
+    stmt, params = table_stmt(s[0]), None
+    if since is not None:
+        # an ISO date compares correctly against both datetime columns and
+        # sqlite's text dates, where a datetime parameter would not
+        stmt, params = stmt + " where date >= ?", [pd.Timestamp(since).
+                                                    strftime("%Y-%m-%d")]
+    df = get_db_data(stmt, s[1], params)
+    df["date"] = pd.to_datetime(df["date"])
+    df.set_index("date", inplace=True)
+    return df
 
 '''
 def get_focus_list_data(s=sql["mfl"]):
@@ -1,9 +1,11 @@
+import os
 import pandas as pd
 import numpy as np
 import par_stats_graphics as gph
 import db_scripts as dbs
+import cache_scripts as cch
+import snapshot_scripts as snp
 from Stats import Stats
-from matplotlib import pyplot as plt
 from collections import OrderedDict
 from datetime import timedelta
 
@@ -15,6 +17,8 @@ QAP = "./qa-data-sources/"
 ROE = "manager_roes.csv"
 BMK = "benchmark_data.xlsx"
 STK = "focus_list_prices_and_market_caps_abridged.xlsx"
+PNL_STORE = "manager_roes"
+ROE_STORE = "manager_roes_wide"
 FMT = {"Figure Size": ((12, 5), (12, 5)),
        "Title Size": (12, 12),
        "AxLab Size": (10, 10)}
@@ -32,60 +36,206 @@ else:
                      FMT["AxLab Size"][1])
 
 # *************************** LOAD PRODUCTION DATA ****************************
-if IOS[0] == "database":
-    pnl = dbs.get_manager_roes()
-elif IOS[0] == "csv":
-    pnl = pd.read_csv(TMP + ROE, header=0, index_col=0, parse_dates=True)
+def load_pnl():
+    if IOS[0] == "database":
+        pnl, delta = sync_pnl()
+    elif IOS[0] == "csv":
+        pnl = cch.read_cached(TMP + ROE, pd.read_csv, header=0, index_col=0,
+                              parse_dates=True)
+        delta = pnl
+
+    dump_pnl(pnl, delta, DSP + ROE) if IOS[1] else np.nan
+    dump_pnl(pnl, delta, TMP + ROE) if IOS[1] else np.nan
+    return pnl
+
+
+def sync_pnl():
+    # pulls only rows at or after the stored high-water mark; the last
+    # stored day comes back again and is de-duplicated on (date, manager).
+    # the store is partitioned by year and only the years the delta lands
+    # in are rewritten
+    pnl = cch.read_parts(PNL_STORE)
+    if pnl is None:
+        pnl = delta = dbs.get_manager_roes()
+        cch.write_parts(pnl, PNL_STORE)
+        return pnl, delta
+    hwm = pnl.index.max()
+    delta = dbs.get_manager_roes(since=hwm)
+    seen = pnl.loc[pnl.index == hwm, "manager"]
+    delta = delta[~((delta.index == hwm) & delta["manager"].isin(seen))]
+    if not len(delta):
+        return pnl, delta
+    years = delta.index.year.unique()
+    cch.write_parts(pd.concat([pnl[pnl.index.year.isin(years)], delta]),
+                    PNL_STORE)
+    return pd.concat([pnl, delta]), delta
+
+
+def dump_pnl(pnl, delta, path):
+    if len(delta) < len(pnl) and os.path.exists(path):
+        delta.to_csv(path, mode="a", header=False)
+    else:
+        pnl.to_csv(path)
+
+
+def load_bmk():
+    bmk = cch.read_cached(TMP + BMK, pd.read_excel, header=0, index_col=1,
+                          parse_dates=True)
+    bmk_cols = ["Manager", "EWFL", "CWFL", "SP500"]
+    bmk = bmk[bmk_cols]
+    bmk.columns = ["manager", "ewfl", "cwfl", "sp500"]
+    bmk.index.names = ["date"]
+    return bmk
+
+
+def load_stk():
+    stk = cch.read_cached(TMP + STK, pd.read_excel, header=0, index_col=1,
+                          parse_dates=True)
+    stk_cols = ["Security", "Close"]
+    stk = stk[stk_cols]
+    stk.columns = ["stock", "price"]
+    stk.index.names = ["date"]
+    return stk
 
-bmk = pd.read_excel(TMP + BMK, header=0, index_col=1, parse_dates=True)
-stk = pd.read_excel(TMP + STK, header=0, index_col=1, parse_dates=True)
-
-# *************************** DUMP PRODUCTION DATA ****************************
-pnl.to_csv(DSP + ROE) if IOS[1] else np.nan
-pnl.to_csv(TMP + ROE) if IOS[1] else np.nan
 
 # ************************ TRANSFORM PRODUCTION DATA **************************
-roe = pd.pivot_table(pnl, values="roe", index="date", columns="manager")
-
-bmk_cols = ["Manager", "EWFL", "CWFL", "SP500"]
-bmk = bmk[bmk_cols]
-bmk.columns = ["manager", "ewfl", "cwfl", "sp500"]
-bmk.index.names = ["date"]
-ewfl = pd.pivot_table(bmk, values="ewfl", index="date", columns="manager")
-cwfl = pd.pivot_table(bmk, values="cwfl", index="date", columns="manager")
-sp500 = pd.pivot_table(bmk, values="sp500", index="date", columns="manager")
-
-stk_cols = ["Security", "Close"]
-stk = stk[stk_cols]
-stk.columns = ["stock", "price"]
-stk.index.names = ["date"]
-stk = pd.pivot_table(stk, values="price", index="date", columns="stock")
-stk = stk.pct_change()
-
-# *************************** TRADITIONAL GROUPS ******************************
-roe = Stats(roe, "daily", "ROE")
-ewfl = Stats(ewfl, "daily", "EWFL")
-cwfl = Stats(cwfl, "daily", "CWFL")
-sp500 = Stats(sp500, "daily", "SP500")
-stk = Stats(stk, "daily", "STOCKS")
-TGP = pd.Series([roe, ewfl, cwfl, sp500, stk])
-
+def fast_pivot(df, values, index="date", columns="manager"):
+    # long -> wide without pivot_table's groupby: (date, column) keys are
+    # unique, so every value is scattered straight into its cell; several
+    # value columns share one pass and duplicate keys fall back to a mean
+    names = [values] if isinstance(values, str) else list(values)
+    if index in df.index.names:
+        rows = df.index.get_level_values(index)
+    else:
+        rows = df[index]
+    r_code, r_uniq = pd.factorize(rows, sort=True)
+    c_code, c_uniq = pd.factorize(df[columns], sort=True)
+    keep = (r_code >= 0) & (c_code >= 0)
+    r_code, c_code = r_code[keep], c_code[keep]
+
+    cell = r_code.astype(np.int64) * len(c_uniq) + c_code
+    vals = df[names].values[keep].astype(np.float64)
+    shape = (len(r_uniq), len(c_uniq), len(names))
+    grid = np.full(shape, np.nan)
+    if np.bincount(cell).max(initial=0) > 1:
+        n_cell = shape[0] * shape[1]
+        for i in range(len(names)):
+            has = ~np.isnan(vals[:, i])
+            total = np.bincount(cell[has], vals[has, i], n_cell)
+            count = np.bincount(cell[has], minlength=n_cell)
+            with np.errstate(invalid="ignore"):
+                grid[:, :, i] = (total / count).reshape(shape[:2])
+    else:
+        grid[r_code, c_code] = vals
+    wide = OrderedDict()
+    for i, x in enumerate(names):
+        v = grid[:, :, i]
+        has = ~np.isnan(v)
+        r_has, c_has = has.any(axis=1), has.any(axis=0)
+        wide[x] = pd.DataFrame(v[r_has][:, c_has],
+                               index=pd.Index(r_uniq[r_has], name=index),
+                               columns=pd.Index(c_uniq[c_has], name=columns))
+    return wide[values] if isinstance(values, str) else wide
+
+
+def pivot_roe(pnl):
+    if IOS[0] != "database":
+        return fast_pivot(pnl, "roe")
+
+    # new rows are never older than the stored pivot's last day, so only
+    # that day onwards is re-pivoted and spliced onto the stored history;
+    # nothing is written when it is unchanged, otherwise only the years
+    # from that day on are rewritten
+    roe = cch.read_parts(ROE_STORE)
+    if roe is None:
+        roe = fast_pivot(pnl, "roe")
+        cch.write_parts(roe, ROE_STORE)
+        return roe
+    roe = roe[sorted(roe.columns)]
+    tail = roe.index.max()
+    new = fast_pivot(pnl[pnl.index >= tail], "roe")
+    if new.equals(roe[roe.index >= tail].dropna(how="all", axis=1)):
+        return roe.dropna(how="all", axis=1)
+    roe = pd.concat([roe[roe.index < tail], new])
+    roe = roe.dropna(how="all", axis=1)
+    roe = roe[sorted(roe.columns)]
+    cch.write_parts(roe[roe.index.year >= tail.year], ROE_STORE)
+    return roe
+
+
+def build_group(name):
+    if name == "roe":
+        g = pivot_roe(source("pnl"))
+    elif name in ["ewfl", "cwfl", "sp500"]:
+        g = source("bmk_wide")[name]
+    elif name == "stk":
+        g = fast_pivot(source("stk"), "price", columns="stock")
+        g = g.pct_change()
+    g = Stats(g, "daily", GROUPS[name])
+    g.fill_gaps()
+    return g
 
-def fillgaps(data):
-    s = []
-    data.r.apply(lambda col: s.append(col.loc[col.first_valid_index():
-                                      col.last_valid_index()].fillna(0)))
-    data.r = pd.DataFrame(s).transpose()
-    data.r0 = pd.DataFrame(s).transpose()
 
-TGP.apply(lambda x: fillgaps(x))
+# *************************** TRADITIONAL GROUPS ******************************
+# sources and groups are built on first access and kept for the session, so
+# importing this module costs no I/O and each group only loads what it uses;
+# scipy and matplotlib are likewise imported by the functions that use them
+SOURCES = OrderedDict([("pnl", load_pnl), ("bmk", load_bmk),
+                       ("bmk_wide", lambda: fast_pivot(
+                           source("bmk"), ["ewfl", "cwfl", "sp500"])),
+                       ("stk", load_stk)])
+GROUPS = OrderedDict([("roe", "ROE"), ("ewfl", "EWFL"), ("cwfl", "CWFL"),
+                      ("sp500", "SP500"), ("stk", "STOCKS")])
+LOADED = {}
+
+
+def source(name):
+    if ("source", name) not in LOADED:
+        LOADED[("source", name)] = SOURCES[name]()
+    return LOADED[("source", name)]
+
+
+def get_group(name):
+    if name not in LOADED:
+        LOADED[name] = build_group(name)
+    return LOADED[name]
+
+
+def __getattr__(name):
+    if name in GROUPS:
+        return get_group(name)
+    if name in SOURCES:
+        return source(name)
+    if name == "TGP":
+        return pd.Series([get_group(x) for x in GROUPS])
+    raise AttributeError("module " + __name__ + " has no attribute " + name)
+
+
+def build_snapshots(names=("roe",), window=252, var_lev=5):
+    # precomputed horizon stats and rolling series for the dashboards; rerun
+    # after new data is loaded, stale snapshots are ignored by their readers
+    return OrderedDict((x, snp.write_snapshot(get_group(x), x, window,
+                                              var_lev)) for x in names)
+
+
+def current_snapshot(name="roe", window=252, var_lev=5):
+    # the group's snapshot as of its loaded data, rebuilt first when the
+    # stored one predates that data or was built with other settings
+    g = get_group(name)
+    snap = snp.load_snapshot(name, g.max_date)
+    if snap is None or tuple(snap["Meta"].get(x) for x in
+                             ("window", "var_lev", "rf")) != \
+            (window, var_lev, g.rf):
+        snp.write_snapshot(g, name, window, var_lev)
+        snap = snp.load_snapshot(name, g.max_date)
+    return snap
 
 
 # ***************************** DYNAMIC GROUPs ********************************
 def create_group(stocks=["UAL", "JBLU"], weights=[50, 50],
                  group_name="Custom", start="1989-12-31", end="2049-12-31"):
 
-    g = stk.r[stocks]
+    g = get_group("stk").view(stocks)
     g = g[start:end]
 
     # calculate group return
@@ -100,12 +250,12 @@ def create_group(stocks=["UAL", "JBLU"], weights=[50, 50],
 
 
 # **************************** CHARTING FEATURES ******************************
-def chart_stats(entity="PAR", series=roe, stat="Volatility",
+def chart_stats(entity="PAR", series=None, stat="Volatility",
                 start="1989", end="2049", var_lev=5,
                 bins=100, window=252, size=FIG):
 
-    s = series
-    r = s.r0[entity][start:end].dropna()
+    s = get_group("roe") if series is None else series
+    r = s.column(entity, start, end)
     begin = r.index.min().strftime("%m/%d/%Y")
     end = r.index.max().strftime("%m/%d/%Y")
     n = str(r.count())
@@ -119,41 +269,24 @@ def chart_stats(entity="PAR", series=roe, stat="Volatility",
         return
 
     if stat == "VaR":
-        roll = pd.DataFrame(OrderedDict({
-                x: r.rolling(window).apply(lambda v, lev=var_lev, mode=x:
-                                           s.var(pd.Series(v), lev, mode))
-                for x in VAR}))
+        roll = s.rolling_var(r, var_lev, window, mode="rolling")[VAR]
         roll.columns = ["Historic", "Modified", "Conditional"]
 
         gph.vsk_line(roll.plot(kind="line", figsize=size, linewidth=2),
                      entity, s.name, stat, var_lev,
                      "Rolling " + str(window) + "-Day")
 
-        cum = pd.DataFrame(OrderedDict({
-                x: r.rolling(len(r), min_periods=window).
-                apply(lambda x, lev=var_lev, mode=x:
-                      s.var(pd.Series(x), lev, mode)) for x in VAR}))
+        cum = s.rolling_var(r, var_lev, window, mode="expanding")[VAR]
         cum.columns = ["Historic", "Modified", "Conditional"]
 
         gph.vsk_line(cum.plot(kind="line", figsize=size, linewidth=2),
                      entity, s.name, stat, var_lev, "Cumulative")
         return
 
-    if stat == "Volatility":
-        rolling_stat = r.rolling(window). \
-            apply(lambda x, mode="annualized": s.hz_vol(x, mode))
-        cum_stat = r.rolling(len(r), min_periods=window). \
-            apply(lambda x, mode="annualized": s.hz_vol(x, mode))
-
-    if stat == "Skewness":
-        rolling_stat = r.rolling(window).apply(lambda x: s.skewness(x))
-        cum_stat = r.rolling(len(r), min_periods=window). \
-            apply(lambda x: s.skewness(x))
-
-    if stat == "Kurtosis":
-        rolling_stat = r.rolling(window).apply(lambda x: s.kurtosis(x))
-        cum_stat = r.rolling(len(r), min_periods=window). \
-            apply(lambda x: s.kurtosis(x))
+    rolling_stat = s.rolling_moments(r, window, mode="rolling",
+                                     vol_mode="annualized")[stat]
+    cum_stat = s.rolling_moments(r, window, mode="expanding",
+                                 vol_mode="annualized")[stat]
 
     ax = rolling_stat.plot(kind="line", figsize=size, linewidth=2,
                            label="Rolling " + str(window) + "-Day")
@@ -162,63 +295,108 @@ def chart_stats(entity="PAR", series=roe, stat="Volatility",
     gph.vsk_line(ax, entity, s.name, stat)
 
 
-def chart_drawdown(entity="PAR", series=roe, config="absolute",
+def chart_drawdown(entity="PAR", series=None, config="absolute",
                    start="1989", end="2049", size=FIG):
-    s = series
-    r = s.r0[entity][start:end].dropna()
+    from matplotlib import pyplot as plt
+    s = get_group("roe") if series is None else series
+    r = s.column(entity, start, end)
 
     if config == "absolute":
+        dd = s.drawdowns(r, mode="series")
         dd_lev = pd.DataFrame(OrderedDict({
-                "Wealth Index": s.drawdowns(r, mode="series")["wealth"],
-                "Peaks": s.drawdowns(r, mode="series")["peaks"]
+                "Wealth Index": dd["wealth"],
+                "Peaks": dd["peaks"]
                 }))
         gph.drawdown(dd_lev.plot(kind="line", figsize=size, linewidth=2),
                      entity, s.name, mode="level")
         plt.show()
 
-        dd_pct = s.drawdowns(r, mode="series")["drawdown"]
+        dd_pct = dd["drawdown"]
         gph.drawdown(dd_pct.plot(kind="line", figsize=size, linewidth=2),
                      entity, s.name, mode="pct")
 
     if config == "relative":
         peaks_df = pd.DataFrame(OrderedDict({
-                x.name: x.drawdowns(x.r0[entity][start:end].dropna(),
+                x.name: x.drawdowns(x.column(entity, start, end),
                                     mode="series")["peaks"]
-                for x in [roe, sp500, ewfl, cwfl]}))
+                for x in map(get_group, ["roe", "sp500", "ewfl", "cwfl"])}))
         peaks_df.columns = ["ROE", "SP500", "EWFL", "CWFL"]
         peaks_df.dropna(inplace=True)
         gph.drawdown(peaks_df.plot.line(figsize=size, linewidth=2),
                      entity, s.name, mode="level", config="relative")
 
 
-def chart_average_cor(fund=roe, market=sp500, window=252):
+def chart_average_cor(fund=None, market=None, window=252):
+    fund = get_group("roe") if fund is None else fund
+    market = get_group("sp500") if market is None else market
     corr_ts, corr_df = fund.average_cor(fund, market, window)
     gph.average_cor(corr_df, fund, market, window, corr_ts)
 
 
-def chart_cppi(entity="PAR", fund=roe, safe_asset=None, risk_multiplier=4,
+def chart_cppi(entity="PAR", fund=None, safe_asset=None, risk_multiplier=4,
                initial_wealth=100, floor_pct=0.80, risk_free_rate=0.03,
                drawdown_constraint=None, start="1989", end="2049"):
+    fund = get_group("roe") if fund is None else fund
     cppi_dc = fund.cppi(fund.r, safe_asset, risk_multiplier, initial_wealth,
                         floor_pct, risk_free_rate, drawdown_constraint,
                         start, end)
     gph.cppi(cppi_dc, entity)
 
 
+def sweep_cppi(fund=None, risk_multiplier=(2, 3, 4, 5),
+               floor_pct=(0.7, 0.8, 0.9), drawdown_constraint=(None, 0.1, 0.2),
+               start=("1989",), end="2049", risk_free_rate=0.03,
+               initial_wealth=100, n_workers=None):
+    fund = get_group("roe") if fund is None else fund
+    cube = fund.cppi_sweep(fund.r, risk_multiplier, floor_pct,
+                           drawdown_constraint, start, end, risk_free_rate,
+                           initial_wealth, n_workers)
+    return fund.cppi_rank(cube)
+
+
+def simulate_cppi(entity="PAR", fund=None, mode="bootstrap", n_years=10,
+                  n_scenarios=10000, risk_multiplier=4, floor_pct=0.80,
+                  drawdown_constraint=None, risk_free_rate=0.03,
+                  initial_wealth=100, mu=7, sigma=15, block_len=21,
+                  resample="stationary", seed=None):
+    fund = get_group("roe") if fund is None else fund
+    mc = fund.mc_cppi(n_years, n_scenarios, risk_multiplier, floor_pct,
+                      drawdown_constraint, risk_free_rate, initial_wealth,
+                      mode, mu, sigma, entity, block_len, resample, seed)
+    return mc["Summary"]
+
+
+def bootstrap_stats(entity="PAR", fund=None, n_years=1, n_scenarios=1000,
+                    block_len=21, resample="stationary", seed=None):
+    fund = get_group("roe") if fund is None else fund
+    paths = fund.bootstrap(int(n_years * fund.ppy), n_scenarios, entity,
+                           block_len, resample, seed)
+    return fund.stats(paths)
+
+
 def chart_gbm_paths(n_years=1, n_scenarios=100, mu=7, sigma=15,
-                    frequency="daily", price0=100, fund=roe):
+                    frequency="daily", price0=100, fund=None):
+    fund = get_group("roe") if fund is None else fund
     prices = fund.gbm(n_years, n_scenarios, mu, sigma, frequency, price0)
     gph.gbm_prices(prices, n_years, n_scenarios, mu, sigma)
 
-def chart_markowitz_mvs(group=["Paul", "Kevin"], series=roe, n=100, rfr=0.04,
+
+def chart_gbm_terminal(n_years=10, n_scenarios=100000, mu=7, sigma=15,
+                       frequency="daily", price0=100, floor_pct=0.80,
+                       seed=None, bins=100, n_workers=1, fund=None):
+    fund = get_group("roe") if fund is None else fund
+    mc = fund.mc_gbm(n_years, n_scenarios, mu, sigma, frequency, price0,
+                     floor_pct, seed, n_workers=n_workers)
+    gph.gbm_terminal(mc, n_years, n_scenarios, mu, sigma, floor_pct, bins)
+    return mc
+
+def chart_markowitz_mvs(group=["Paul", "Kevin"], series=None, n=100, rfr=0.04,
                         start="1989", end="2049",
                         show_cml=True, show_ndp=True, show_gmv=True,
                         style=".-", size=FIG):
-    s = series
+    s = get_group("roe") if series is None else series
     s.change_hz(start, end)
-    er = s.stats().loc[group, "Annualized Return"]
-    regroup = list(er.index)
-    cov = s.r[regroup].cov()
+    er, cov = s.mv_inputs(group)
     mef = s.mef(n, er, cov)
     ax = mef.plot.scatter(x="Volatility", y="Return", figsize=size)
 
@@ -1,6 +1,5 @@
 import pandas as pd
 from collections import OrderedDict
-from matplotlib import pyplot as plt
 
 FMT = {"Figure Size": ((12, 5), (12, 5)),
        "Title Size": (12, 12),
@@ -120,6 +119,7 @@ def cppi(dc, entity):
 
 
 def gbm_prices(prices, n_years, n_scenarios, mu, sigma):
+    from matplotlib import pyplot as plt
     plt.figure(1)
     ax = prices.plot.line(figsize=FIG, legend=False)
     year = "year " if n_years == 1 else "years "
@@ -132,4 +132,32 @@ def gbm_prices(prices, n_years, n_scenarios, mu, sigma):
     ax.set_ylabel("Price (Base = $100)", fontsize=ALS)
     ax.tick_params(axis='both', which='major', labelsize=ALS)
     plt.show()
-    return
\ No newline at end of file
+    return
+
+
+def gbm_terminal(mc, n_years, n_scenarios, mu, sigma, floor_pct, bins=100):
+    from matplotlib import pyplot as plt
+    # mc["Terminal"] is already binned: scenario counts by terminal price
+    h = mc["Terminal"][mc["Terminal"] > 0]
+    _, ax = plt.subplots(figsize=FIG)
+    ax.hist(h.index, bins=bins, weights=h.values)
+    q = mc["Quantiles"]
+    for x, color in [(0.05, "red"), (0.5, "yellow"), (0.95, "red")]:
+        if x in q.index:
+            ax.axvline(x=q.loc[x], color=color)
+    year = "year " if n_years == 1 else "years "
+    ax.set_title("GBM Terminal Price Distribution: " +
+                 str(n_scenarios) + " scenarios run over " +
+                 str(n_years) + " " + year +
+                 "with " + r"$\mu = $" + str(mu) + "%" +
+                 ", " + r"$\sigma = $" + str(sigma) + "%",
+                 fontdict={"fontsize": TIS, "fontweight": "bold"})
+    ax.set_xlabel("Terminal Price (Base = $100)", fontsize=ALS)
+    ax.set_ylabel("Frequency", fontsize=ALS)
+    ax.tick_params(axis='both', which='major', labelsize=ALS)
+
+    print(pd.DataFrame(OrderedDict({"Terminal Price": q})))
+    print("Probability of breaching the " + str(int(floor_pct * 100)) +
+          "% floor: " + "{:.2%}".format(mc["Breach Probability"]))
+    plt.show()
+    return ax
@@ -0,0 +1,97 @@
+import pandas as pd
+import cache_scripts as cch
+from collections import OrderedDict
+
+HORIZONS = ["MTD", "QTD", "YTD", "1Y", "3Y", "Inception"]
+ROLLING_COLS = ["Volatility", "Skewness", "Kurtosis", "Historic VaR",
+                "Parametric VaR", "Modified VaR", "Conditional VaR"]
+
+
+# ******************************** HORIZONS ***********************************
+def horizon_start(asof, horizon, inception):
+    if horizon == "MTD":
+        return asof.to_period("M").start_time
+    if horizon == "QTD":
+        return asof.to_period("Q").start_time
+    if horizon == "YTD":
+        return asof.to_period("Y").start_time
+    if horizon == "1Y":
+        return asof - pd.DateOffset(years=1) + pd.Timedelta(days=1)
+    if horizon == "3Y":
+        return asof - pd.DateOffset(years=3) + pd.Timedelta(days=1)
+    if horizon == "Inception":
+        return inception
+
+
+# ******************************** BUILDERS ***********************************
+def build_stats(s, asof=None, horizons=HORIZONS, var_lev=None):
+    # one stats() row per horizon and entity, off the prefix sums; var_lev in
+    # percent as for build_rolling, s's own level when None
+    asof = s.max_date if asof is None else pd.Timestamp(asof)
+    lev = s.var_lev
+    if var_lev is not None:
+        s.var_lev = var_lev / 100
+    try:
+        tables = [s.hz_stats(horizon_start(asof, x, s.min_date), asof)
+                  for x in horizons]
+    finally:
+        s.var_lev = lev
+    return pd.concat(tables, keys=list(horizons), names=["Horizon"])
+
+
+def build_rolling(s, window=252, var_lev=5):
+    # the chart_stats series of every entity over its whole history
+    rolling = OrderedDict()
+    for entity in s.names:
+        r = s.column(entity)
+        if not len(r):
+            continue
+        m = s.rolling_moments(r, window, vol_mode="annualized")
+        v = s.rolling_var(r, var_lev, window)
+        v.columns = ROLLING_COLS[3:]
+        rolling[entity] = pd.concat([m[ROLLING_COLS[:3]], v], axis=1)
+    return pd.concat(rolling, names=[s.names.name or "entity"])
+
+
+# ******************************* SNAPSHOTS ***********************************
+# snapshots are feather stores tagged with the data's last date, the window,
+# the VaR level of both tables and the risk-free rate, so readers can tell
+# whether they still apply
+def write_snapshot(s, name, window=252, var_lev=5,
+                   store_path=cch.STORE_PATH):
+    meta = {"asof": str(s.max_date), "window": window, "var_lev": var_lev,
+            "rf": s.rf}
+    cch.write_store(build_stats(s, var_lev=var_lev), name + "_stats",
+                    store_path, meta)
+    cch.write_store(build_rolling(s, window, var_lev), name + "_rolling",
+                    store_path, meta)
+    return meta
+
+
+def load_snapshot(name, asof=None, store_path=cch.STORE_PATH):
+    # memory-maps both stores; None when missing, built on other data or
+    # settings, or left half-written by an interrupted build
+    meta = [cch.read_store_meta(name + x, store_path)
+            for x in ("_stats", "_rolling")]
+    if None in meta or \
+            dict(meta[0], store=None) != dict(meta[1], store=None):
+        return None
+    meta = meta[1]
+    if asof is not None and meta["asof"] != str(pd.Timestamp(asof)):
+        return None
+    return OrderedDict([
+        ("Stats", cch.read_store(name + "_stats", store_path)),
+        ("Rolling", cch.read_store(name + "_rolling", store_path)),
+        ("Meta", meta)])
+
+
+def lookup_stats(snap, entity=None, horizon="Inception"):
+    table = snap["Stats"].loc[horizon]
+    return table if entity is None else table.loc[entity]
+
+
+def lookup_rolling(snap, entity, window=252, var_lev=5):
+    if snap is None or (snap["Meta"]["window"], snap["Meta"]["var_lev"]) != \
+            (window, var_lev) or entity not in snap["Rolling"].index:
+        return None
+    return snap["Rolling"].loc[entity]